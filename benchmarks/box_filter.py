@@ -0,0 +1,96 @@
+"""对比 filter_overlapping_boxes 新旧实现在不同框数量下的耗时
+
+python -m benchmarks.box_filter --boxes 100 1000 5000
+"""
+
+import argparse
+import random
+import time
+import torch
+
+from collections import defaultdict
+from torchvision.ops import box_iou
+from common import utils
+
+
+# 原来的实现: 每一对框都新建两个 tensor 再计算 IoU
+def legacy_filter_overlapping_boxes(boxes, scores, iou_threshold):
+    filtered_boxes = []
+    seen = defaultdict(bool)
+
+    for i, box1 in enumerate(boxes):
+        if seen[i]:
+            continue
+
+        filtered_boxes.append(box1)
+        for j, box2 in enumerate(boxes[i + 1 :], start=i + 1):
+            box1_tensor = torch.tensor(
+                [[box1["xmin"], box1["ymin"], box1["xmax"], box1["ymax"]]]
+            )
+            box2_tensor = torch.tensor(
+                [[box2["xmin"], box2["ymin"], box2["xmax"], box2["ymax"]]]
+            )
+            iou = box_iou(box1_tensor, box2_tensor)[0][0].item()
+            if iou > iou_threshold:
+                if scores[i] > scores[j]:
+                    seen[j] = True
+                else:
+                    seen[i] = True
+
+    return filtered_boxes
+
+
+def build_detections(count, width=1920, height=20000, seed=0):
+    rng = random.Random(seed)
+    results = []
+    for _ in range(count):
+        x = rng.randint(0, width - 300)
+        y = rng.randint(0, height - 300)
+        w = rng.randint(40, 300)
+        h = rng.randint(40, 300)
+        results.append(
+            {
+                # 分数保留两位小数, 让同分的情况也被覆盖到
+                "score": round(rng.random(), 2),
+                "box": {"xmin": x, "ymin": y, "xmax": x + w, "ymax": y + h},
+            }
+        )
+    # 与 model_registry.detect 一致, 按分数从高到低排序
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return [result["box"] for result in results], [r["score"] for r in results]
+
+
+def _timed(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boxes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--iou-threshold", type=float, default=0.005)
+    parser.add_argument(
+        "--skip-legacy-over",
+        type=int,
+        default=1000,
+        help="超过该框数量时不再运行旧实现",
+    )
+    args = parser.parse_args()
+
+    for count in args.boxes:
+        boxes, scores = build_detections(count)
+        new_boxes, new_time = _timed(
+            utils.filter_overlapping_boxes, boxes, scores, args.iou_threshold
+        )
+        line = f"boxes={count:<6} kept={len(new_boxes):<5} new={new_time:.3f}s"
+        if count <= args.skip_legacy_over:
+            old_boxes, old_time = _timed(
+                legacy_filter_overlapping_boxes, boxes, scores, args.iou_threshold
+            )
+            line += f" legacy={old_time:.3f}s same={old_boxes == new_boxes}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
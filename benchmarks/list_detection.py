@@ -0,0 +1,179 @@
+"""对比 get_api_html_list 新旧实现在大页面上的耗时, 并在随机页面上校验两者结果一致
+
+python -m benchmarks.list_detection --items 200 1000 5000 25000
+python -m benchmarks.list_detection --check 500
+"""
+
+import argparse
+import random
+import time
+
+from bs4 import BeautifulSoup
+from collections import Counter
+from common import utils
+
+
+# 原来的实现: 每个元素向上查找, 每一层都对兄弟节点做一次递归 find_all
+def _legacy_is_list_item(element):
+    if not element or not element.parent:
+        return False
+    siblings = element.parent.find_all(element.name)
+    for sibling in siblings:
+        if sibling != element:
+            element_classes = set(element.get("class", []))
+            sibling_classes = set(sibling.get("class", []))
+            if element_classes & sibling_classes:
+                return True
+    return False
+
+
+def _legacy_find_list_parent(element):
+    parent = element.parent
+    while parent and parent.name != "body":
+        if _legacy_is_list_item(element):
+            return parent
+        element = parent
+        parent = parent.parent
+    return None
+
+
+def legacy_get_api_html_list(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+    parent_elements = []
+    for element in soup.find_all(True):
+        list_parent = _legacy_find_list_parent(element)
+        if list_parent:
+            parent_elements.append(list_parent)
+
+    if not parent_elements:
+        parent_element = soup.find(True)
+        if parent_element:
+            return [str(c) for c in parent_element.find_all(recursive=False)], ""
+        return [], ""
+
+    most_common_parent, _ = Counter(parent_elements).most_common(1)[0]
+    children_html_list = [
+        str(child) for child in most_common_parent.find_all(recursive=False)
+    ]
+    return children_html_list, most_common_parent.get("class", "")
+
+
+def build_page(items, fragment=False):
+    cards = "".join(
+        f'<div class="card card-{i % 3}">'
+        f'<a class="link" href="/watch/{i}"><img class="thumb" src="/{i}.jpg"></a>'
+        f'<div class="info"><span class="brand">Brand {i}</span>'
+        f'<span class="price">{i * 10} USD</span></div></div>'
+        for i in range(items)
+    )
+    nav = "".join(f'<li class="nav-item"><a href="/c/{i}">{i}</a></li>' for i in range(8))
+    content = (
+        f'<header><ul class="nav">{nav}</ul></header>'
+        f'<main><section class="grid">{cards}</section></main>'
+    )
+    if fragment:
+        return content
+    return f"<html><head><title>bench</title></head><body>{content}</body></html>"
+
+
+def build_random_page(rng):
+    # 随机嵌套结构: 无 class 的同名兄弟、共享部分 class、表格、完全相同的重复元素等
+    # 只生成合法的嵌套, 浏览器/接口返回的 HTML 在 lxml 和 html.parser 下解析出的树相同
+    block = ["div", "section", "ul", "table", "span", "a", "p"]
+    children_of = {
+        "div": block,
+        "section": block,
+        "li": block,
+        "td": block,
+        "ul": ["li"],
+        "table": ["tr"],
+        "tr": ["td"],
+        "span": ["span", "a"],
+        "p": ["span", "a"],
+        "a": ["span"],
+    }
+    classes = ["card", "item", "grid", "nav", "price", "brand", "row", "col"]
+
+    def element(tag, depth):
+        attrs = ""
+        if rng.random() < 0.6:
+            attrs = f' class="{" ".join(rng.sample(classes, rng.randint(1, 2)))}"'
+        if depth >= 4 or rng.random() < 0.2:
+            text = rng.choice(["", "Rolex", "100 USD"])
+            if tag in ("ul", "table", "tr"):
+                text = ""
+            return f"<{tag}{attrs}>{text}</{tag}>"
+        options = children_of[tag]
+        child = element(rng.choice(options), depth + 1)
+        children = [
+            child if rng.random() < 0.3 else element(rng.choice(options), depth + 1)
+            for _ in range(rng.randint(1, 5))
+        ]
+        return f"<{tag}{attrs}>{''.join(children)}</{tag}>"
+
+    content = "".join(
+        element(rng.choice(["div", "section", "ul", "table"]), 0)
+        for _ in range(rng.randint(1, 3))
+    )
+    if rng.random() < 0.5:
+        return content
+    return f"<html><body>{content}</body></html>"
+
+
+def check(count, seed):
+    rng = random.Random(seed)
+    pages = [build_page(20), build_page(20, fragment=True)] + [
+        build_random_page(rng) for _ in range(count)
+    ]
+    mismatches = 0
+    for html in pages:
+        if utils.get_api_html_list(html) != legacy_get_api_html_list(html):
+            mismatches += 1
+    print(f"checked {len(pages)} pages, {mismatches} mismatches")
+    return mismatches
+
+
+def _timed(fn, html):
+    start_time = time.perf_counter()
+    result = fn(html)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # 25000 项约 5MB, 对应线上最大的列表接口响应
+    parser.add_argument(
+        "--items", type=int, nargs="+", default=[200, 1000, 5000, 25000]
+    )
+    parser.add_argument(
+        "--skip-legacy-over",
+        type=int,
+        default=100,
+        help="超过该列表项数量时不再运行旧实现(旧实现在 100 项时已需要十几秒)",
+    )
+    parser.add_argument("--check", type=int, default=0, help="校验的随机页面数量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(1 if check(args.check, args.seed) else 0)
+
+    for items in args.items:
+        for fragment in (False, True):
+            html = build_page(items, fragment)
+            (new_list, new_parent), new_time = _timed(utils.get_api_html_list, html)
+            line = (
+                f"items={items:<6} fragment={fragment!s:<5} "
+                f"size={len(html) / 1024 / 1024:.2f}MB new={new_time:.3f}s"
+            )
+            if items <= args.skip_legacy_over:
+                (old_list, old_parent), old_time = _timed(
+                    legacy_get_api_html_list, html
+                )
+                same = old_list == new_list and old_parent == new_parent
+                line += f" legacy={old_time:.3f}s same_result={same}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
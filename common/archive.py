@@ -0,0 +1,352 @@
+import os
+import gzip
+import time
+import uuid
+import hashlib
+import asyncio
+import logging
+import threading
+import aioboto3
+
+from contextlib import AsyncExitStack
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from common import db, metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 原始页面在后台队列中归档到 S3, 响应不再等待上传完成
+ARCHIVE_CONCURRENCY = int(os.getenv("ARCHIVE_CONCURRENCY", "4"))
+ARCHIVE_QUEUE_SIZE = int(os.getenv("ARCHIVE_QUEUE_SIZE", "200"))
+# gzip / zstd / none, 没有安装 zstandard 时退回 gzip
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+ARCHIVE_MULTIPART_THRESHOLD = int(
+    os.getenv("ARCHIVE_MULTIPART_THRESHOLD", str(16 * 1024 * 1024))
+)
+ARCHIVE_PART_SIZE = int(os.getenv("ARCHIVE_PART_SIZE", str(8 * 1024 * 1024)))
+ARCHIVE_DRAIN_TIMEOUT = float(os.getenv("ARCHIVE_DRAIN_TIMEOUT", "30"))
+# 按内容哈希命名对象, 内容相同的快照只上传一次
+ARCHIVE_CONTENT_ADDRESSED = os.getenv("ARCHIVE_CONTENT_ADDRESSED", "1") == "1"
+# 本地索引中没有记录时, 上传前先用 HEAD 检查对象是否已经存在
+ARCHIVE_HEAD_CHECK = os.getenv("ARCHIVE_HEAD_CHECK", "1") == "1"
+
+_session = aioboto3.Session()
+_exit_stack = None
+_client = None
+_queue = None
+_workers = []
+# 已经在队列中等待上传的快照 -> 上传成功后需要记录的地址
+_pending = {}
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = db.connect("archive_index.db")
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS archive_objects (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            # 每个地址最近一次抓取对应的快照
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS archive_manifest (
+                    url TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            _conn.execute(
+                "CREATE INDEX IF NOT EXISTS archive_manifest_name ON archive_manifest (name)"
+            )
+    return _conn
+
+
+def is_archived(name):
+    row = (
+        _get_conn()
+        .execute("SELECT 1 FROM archive_objects WHERE name = ?", (name,))
+        .fetchone()
+    )
+    return row is not None
+
+
+def mark_archived(name, size):
+    _get_conn().execute(
+        "INSERT OR IGNORE INTO archive_objects (name, size, created_at) VALUES (?, ?, ?)",
+        (name, size, time.time()),
+    )
+
+
+def record_snapshot(url, name):
+    _get_conn().execute(
+        "INSERT OR REPLACE INTO archive_manifest (url, name, updated_at) VALUES (?, ?, ?)",
+        (url, name, time.time()),
+    )
+
+
+def latest_snapshot(url):
+    row = (
+        _get_conn()
+        .execute("SELECT name FROM archive_manifest WHERE url = ?", (url,))
+        .fetchone()
+    )
+    return row[0] if row else None
+
+
+def snapshot_url(name):
+    # 快照对应的抓取地址, 同一内容被多个地址引用时返回最近的一个
+    row = (
+        _get_conn()
+        .execute(
+            "SELECT url FROM archive_manifest WHERE name = ? ORDER BY updated_at DESC",
+            (name,),
+        )
+        .fetchone()
+    )
+    return row[0] if row else None
+
+
+def content_name(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def get_config():
+    # 从环境变量中获取 AWS 相关配置, S3_ENDPOINT_URL 用于本地的 S3 替身(例如 moto)
+    return {
+        "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID", ""),
+        "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY", ""),
+        "bucket_name": os.getenv("S3_BUCKET_NAME", ""),
+        "prefix": os.getenv("S3_BUCKET_HTML_SAVE_PATH", ""),
+        "region_name": os.getenv("S3_BUCKET_REGION_NAME", "") or None,
+        "endpoint_url": os.getenv("S3_ENDPOINT_URL") or None,
+    }
+
+
+def is_configured(config):
+    return all(
+        [
+            config["aws_access_key_id"],
+            config["aws_secret_access_key"],
+            config["bucket_name"],
+            config["prefix"],
+        ]
+    )
+
+
+def object_key(config, name):
+    return f"{config['prefix']}/{name}"
+
+
+async def get_client():
+    # 整个进程共用一个 S3 客户端, 复用连接池和凭证
+    global _exit_stack, _client
+    if _client is None:
+        config = get_config()
+        _exit_stack = AsyncExitStack()
+        _client = await _exit_stack.enter_async_context(
+            _session.client(
+                "s3",
+                aws_access_key_id=config["aws_access_key_id"],
+                aws_secret_access_key=config["aws_secret_access_key"],
+                region_name=config["region_name"],
+                endpoint_url=config["endpoint_url"],
+                config=Config(max_pool_connections=ARCHIVE_CONCURRENCY * 2),
+            )
+        )
+    return _client
+
+
+def compress(body):
+    # 返回 (压缩后的内容, Content-Encoding)
+    if ARCHIVE_COMPRESSION == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+    if ARCHIVE_COMPRESSION in ("gzip", "zstd"):
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+
+def decompress(body, content_encoding):
+    if content_encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompress(body)
+    if content_encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+async def _put_multipart(s3, bucket, key, body, extra):
+    upload = await s3.create_multipart_upload(Bucket=bucket, Key=key, **extra)
+    upload_id = upload["UploadId"]
+    try:
+        parts = []
+        for number, start in enumerate(range(0, len(body), ARCHIVE_PART_SIZE), 1):
+            part = await s3.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=body[start : start + ARCHIVE_PART_SIZE],
+            )
+            parts.append({"ETag": part["ETag"], "PartNumber": number})
+        await s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        await s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+async def put(name, body, content_type):
+    config = get_config()
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    s3 = await get_client()
+    key = object_key(config, name)
+    # 先检查对象是否存在, 重复的内容不需要压缩
+    if ARCHIVE_CONTENT_ADDRESSED and ARCHIVE_HEAD_CHECK:
+        try:
+            await s3.head_object(Bucket=config["bucket_name"], Key=key)
+            # 其他实例已经上传过相同内容
+            metrics.incr("archive.deduplicated")
+            mark_archived(name, len(body))
+            return
+        except ClientError:
+            pass
+
+    compressed, content_encoding = await asyncio.to_thread(compress, body)
+    extra = {"ContentType": content_type}
+    if content_encoding:
+        extra["ContentEncoding"] = content_encoding
+
+    if len(compressed) > ARCHIVE_MULTIPART_THRESHOLD:
+        await _put_multipart(s3, config["bucket_name"], key, compressed, extra)
+    else:
+        await s3.put_object(
+            Bucket=config["bucket_name"], Key=key, Body=compressed, **extra
+        )
+
+    if ARCHIVE_CONTENT_ADDRESSED:
+        mark_archived(name, len(body))
+    metrics.incr("archive.bytes", len(body))
+    metrics.incr("archive.stored_bytes", len(compressed))
+    logging.info(
+        f"Successfully uploaded to {config['bucket_name']}/{key}, "
+        f"{len(body)} -> {len(compressed)} bytes"
+    )
+
+
+async def get(name):
+    # 下载快照并按 ContentEncoding 解压, 返回 (原始内容, Content-Type)
+    config = get_config()
+    s3 = await get_client()
+    response = await s3.get_object(
+        Bucket=config["bucket_name"], Key=object_key(config, name)
+    )
+    async with response["Body"] as stream:
+        body = await stream.read()
+    body = await asyncio.to_thread(
+        decompress, body, response.get("ContentEncoding")
+    )
+    return body, response.get("ContentType") or "text/html"
+
+
+async def _worker():
+    while True:
+        name, body, content_type = await _queue.get()
+        try:
+            with metrics.timer("archive.upload_seconds"):
+                await put(name, body, content_type)
+        except Exception as e:
+            metrics.incr("archive.failed")
+            logging.info(f"Error uploading to S3: {e}")
+            _pending.pop(name, None)
+        else:
+            # 对象确实存在后才写入地址索引, 上传失败时索引不会指向不存在的对象
+            for url in _pending.pop(name, ()):
+                record_snapshot(url, name)
+        finally:
+            _queue.task_done()
+
+
+def start():
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+    for _ in range(ARCHIVE_CONCURRENCY):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop():
+    # 尽量把队列中的归档写完再关闭客户端
+    global _queue, _client, _exit_stack
+    if _queue is not None:
+        try:
+            await asyncio.wait_for(_queue.join(), ARCHIVE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.info(f"Archive queue not drained, {_queue.qsize()} pending")
+        for worker in _workers:
+            worker.cancel()
+        _workers.clear()
+        _queue = None
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+        _exit_stack = None
+        _client = None
+
+
+def submit(body, content_type="text/html", url=None):
+    # 立即返回快照名称, 上传在后台完成; 未配置或队列已满时返回 None
+    # 地址到快照的索引在上传成功后才写入
+    if not body:
+        logging.info("Error: No HTML content provided.")
+        return None
+    if not is_configured(get_config()):
+        logging.info("Error: Missing environment variables.")
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    start()
+    if ARCHIVE_CONTENT_ADDRESSED:
+        # 快照名称就是内容哈希, 相同内容不再重复上传
+        name = content_name(body)
+        if name in _pending:
+            metrics.incr("archive.deduplicated")
+            if url:
+                _pending[name].add(url)
+            return name
+        if is_archived(name):
+            metrics.incr("archive.deduplicated")
+            if url:
+                record_snapshot(url, name)
+            return name
+    else:
+        name = str(uuid.uuid4())
+
+    try:
+        _queue.put_nowait((name, body, content_type))
+    except asyncio.QueueFull:
+        metrics.incr("archive.dropped")
+        logging.info("Archive queue is full, snapshot dropped")
+        return None
+
+    _pending[name] = {url} if url else set()
+    return name
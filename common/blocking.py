@@ -0,0 +1,199 @@
+import os
+import re
+
+from urllib.parse import urlparse
+from common import metrics
+
+# 浏览器抓取时按资源类型/域名/URL 规则拦截请求, 减少页面加载时间和代理的解密开销
+# none: 不拦截, balanced: 字体/音视频/统计广告域名, minimal: 在 balanced 基础上再拦截上报类 URL
+BLOCKING_PROFILE = os.getenv("BLOCKING_PROFILE", "balanced")
+
+PROFILES = {
+    "none": {"types": set(), "domains": False, "patterns": False},
+    "balanced": {"types": {"font", "media"}, "domains": True, "patterns": False},
+    "minimal": {
+        "types": {"font", "media", "manifest", "track", "object"},
+        "domains": True,
+        "patterns": True,
+    },
+}
+
+DEFAULT_BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+    "facebook.com/tr",
+    "analytics.tiktok.com",
+    "bat.bing.com",
+    "clarity.ms",
+    "hotjar.com",
+    "segment.io",
+    "segment.com",
+    "mixpanel.com",
+    "amplitude.com",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "outbrain.com",
+    "adnxs.com",
+    "scorecardresearch.com",
+    "newrelic.com",
+    "nr-data.net",
+    "quantserve.com",
+    "pinterest.com/ct",
+]
+BLOCKED_DOMAINS = DEFAULT_BLOCKED_DOMAINS + [
+    domain.strip()
+    for domain in os.getenv("BLOCKED_DOMAINS", "").split(",")
+    if domain.strip()
+]
+
+DEFAULT_BLOCKED_URL_PATTERNS = [
+    r"/(?:collect|beacon|pixel|track|tracking|telemetry|log_event)(?:[/?.]|$)",
+    r"/ads?/",
+]
+BLOCKED_URL_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in DEFAULT_BLOCKED_URL_PATTERNS
+    + [p for p in os.getenv("BLOCKED_URL_PATTERNS", "").split(",") if p.strip()]
+]
+
+_EXTENSION_TYPES = {
+    "font": (".woff", ".woff2", ".ttf", ".otf", ".eot"),
+    "media": (".mp4", ".webm", ".m3u8", ".mov", ".mp3", ".ogg", ".wav", ".m4a"),
+    "image": (".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".svg", ".ico"),
+    "style": (".css",),
+    "script": (".js", ".mjs"),
+    "manifest": (".webmanifest",),
+    "track": (".vtt",),
+    "object": (".swf",),
+}
+
+# Sec-Fetch-Dest 与资源类型的对应关系
+_DEST_TYPES = {
+    "font": "font",
+    "video": "media",
+    "audio": "media",
+    "image": "image",
+    "style": "style",
+    "script": "script",
+    "manifest": "manifest",
+    "track": "track",
+    "object": "object",
+    "embed": "object",
+    "document": "document",
+    "iframe": "document",
+}
+
+
+def resource_type(request):
+    # Chrome 会带上 Sec-Fetch-Dest, 没有时再根据扩展名和 Accept 推断
+    dest = request.headers.get("Sec-Fetch-Dest")
+    if dest in _DEST_TYPES:
+        return _DEST_TYPES[dest]
+
+    path = urlparse(request.url).path.lower()
+    for type_name, extensions in _EXTENSION_TYPES.items():
+        if path.endswith(extensions):
+            return type_name
+
+    accept = request.headers.get("Accept") or ""
+    if accept.startswith("image/"):
+        return "image"
+    if accept.startswith(("video/", "audio/")):
+        return "media"
+    if accept.startswith("text/css"):
+        return "style"
+    return "other"
+
+
+def scopes(profile_name):
+    # 拦截规则只对 selenium-wire 范围内的请求生效, 返回该 profile 需要放进范围的 URL 正则
+    # 按资源类型拦截由 Chrome 完成(见 apply_browser_rules), 不需要把所有请求放进范围
+    profile = PROFILES.get(profile_name) or PROFILES["none"]
+    rules = []
+    if profile["domains"]:
+        rules += [
+            rf"^https?://(?:[^/]*\.)?{re.escape(domain)}"
+            for domain in BLOCKED_DOMAINS
+        ]
+    if profile["patterns"]:
+        rules += [f"(?i){pattern.pattern}" for pattern in BLOCKED_URL_PATTERNS]
+    return rules
+
+
+def browser_blocked_urls(profile_name):
+    # Network.setBlockedURLs 只能按 URL 通配符匹配, 按扩展名拦截该 profile 的资源类型
+    # 没有扩展名的字体/音视频仍会加载, 只有在 selenium-wire 范围内时才会按请求头拦截
+    profile = PROFILES.get(profile_name) or PROFILES["none"]
+    patterns = []
+    for type_name in sorted(profile["types"]):
+        for extension in _EXTENSION_TYPES.get(type_name, ()):
+            patterns += [f"*{extension}", f"*{extension}?*"]
+    return patterns
+
+
+def apply_browser_rules(driver, profile_name):
+    # 由 Chrome 直接拦截, 请求不会经过 selenium-wire 代理
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd(
+        "Network.setBlockedURLs", {"urls": browser_blocked_urls(profile_name)}
+    )
+
+
+def _is_blocked_domain(url):
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    host_path = host + parsed.path.lower()
+    for domain in BLOCKED_DOMAINS:
+        if "/" in domain:
+            if host_path.startswith(domain) or f".{domain}" in host_path:
+                return True
+        elif host == domain or host.endswith(f".{domain}"):
+            return True
+    return False
+
+
+def block_reason(request, profile_name):
+    # 返回拦截原因, 不需要拦截时返回 None
+    profile = PROFILES.get(profile_name) or PROFILES["none"]
+    type_name = resource_type(request)
+
+    if profile["domains"] and _is_blocked_domain(request.url):
+        return f"domain.{type_name}"
+    # 图片是视觉检测的输入, 不按类型或 URL 规则拦截
+    if type_name == "image":
+        return None
+    if type_name in profile["types"]:
+        return f"type.{type_name}"
+    if profile["patterns"] and any(
+        pattern.search(request.url) for pattern in BLOCKED_URL_PATTERNS
+    ):
+        return f"pattern.{type_name}"
+    return None
+
+
+def intercept(request, profile_name):
+    reason = block_reason(request, profile_name)
+    if reason is None:
+        return False
+
+    request.abort()
+    metrics.incr(f"blocking.{profile_name}.blocked_requests")
+    metrics.incr(f"blocking.{profile_name}.blocked.{reason}")
+    return True
+
+
+def record_response(request, response, profile_name):
+    # 被拦截的请求拿不到响应大小, 通过放行流量的对比来衡量各个 profile 节省了多少
+    # 只统计 selenium-wire 范围内的响应, 跨 profile 比较用 readiness 记录的 transferred_bytes
+    size = response.headers.get("Content-Length")
+    try:
+        size = int(size) if size is not None else len(response.body or b"")
+    except (TypeError, ValueError):
+        size = 0
+    metrics.incr(f"blocking.{profile_name}.allowed_requests")
+    metrics.incr(f"blocking.{profile_name}.proxied_bytes", size)
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import logging
+
+from urllib.parse import urlparse, parse_qsl
+from seleniumwire.utils import decode
+from common import blocking, metrics
+
+# selenium-wire 默认会在内存中保存所有请求和响应体, 浏览器复用后会无限增长
+CAPTURE_MAX_REQUESTS = int(os.getenv("CAPTURE_MAX_REQUESTS", "300"))
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", str(2 * 1024 * 1024)))
+
+# 可能返回列表数据的接口, 第三方搜索服务的域名也需要在范围内
+DEFAULT_API_SCOPES = [
+    r"(?i)\.json(?:[?#]|$)",
+    r"(?i)/(?:api|graphql|ajax|search|query|queries|products?|catalog|listings?)(?:[/?.#]|$)",
+    r"(?i)algolia\.net|algolianet\.com|searchspring\.io|klevu\.com|cnstrc\.com",
+]
+CAPTURE_EXTRA_SCOPES = [
+    scope for scope in os.getenv("CAPTURE_EXTRA_SCOPES", "").split(",") if scope.strip()
+]
+# 浏览器抓取时先从捕获的 JSON 接口中查找列表数据
+HARVEST_JSON = os.getenv("HARVEST_JSON", "1") == "1"
+HARVEST_MIN_ITEMS = int(os.getenv("HARVEST_MIN_ITEMS", "4"))
+HARVEST_MIN_SCORE = float(os.getenv("HARVEST_MIN_SCORE", "1.0"))
+# 两个任务之间不捕获任何请求
+IDLE_SCOPES = ["$^"]
+
+_JSON_CONTENT_TYPES = ("application/json", "text/json", "+json")
+
+
+def seleniumwire_options():
+    return {
+        "request_storage": "memory",
+        "request_storage_max_size": CAPTURE_MAX_REQUESTS,
+    }
+
+
+def scopes_for(url, profile_name=blocking.BLOCKING_PROFILE):
+    # 目标站点(含子域名) + JSON 接口 + 当前拦截 profile 需要的请求, 其余请求直接透传不缓存
+    host = urlparse(url).netloc.lower().split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    host_scopes = [rf"^https?://(?:[^/]*\.)?{re.escape(host)}(?::\d+)?/"] if host else []
+    return (
+        host_scopes
+        + DEFAULT_API_SCOPES
+        + CAPTURE_EXTRA_SCOPES
+        + blocking.scopes(profile_name)
+    )
+
+
+def set_scope(driver, url):
+    # 必须在设置 driver.blocking_profile 之后调用
+    # 按资源类型拦截交给 Chrome, selenium-wire 只处理目标站点、接口和拦截域名的请求
+    blocking.apply_browser_rules(driver, driver.blocking_profile)
+    driver.scopes = scopes_for(url, driver.blocking_profile)
+
+
+def is_json_response(response):
+    content_type = (response.headers.get("Content-Type") or "").lower()
+    return any(json_type in content_type for json_type in _JSON_CONTENT_TYPES)
+
+
+def limit_storage(driver):
+    # 只保留不超过上限的 JSON 响应体, 其余响应只保存状态和响应头
+    storage = driver.backend.storage
+    save_response = storage.save_response
+
+    def save_limited_response(request_id, response):
+        size = len(response.body or b"")
+        if size and (size > CAPTURE_MAX_BODY_BYTES or not is_json_response(response)):
+            response.body = b""
+            size = 0
+        driver.captured_requests += 1
+        driver.captured_bytes += size
+        save_response(request_id, response)
+
+    storage.save_response = save_limited_response
+    driver.captured_requests = 0
+    driver.captured_bytes = 0
+    driver.scopes = IDLE_SCOPES
+
+
+def record_task(driver):
+    # 每个任务结束时记录捕获的请求数和响应体大小, 然后清空存储
+    metrics.observe("capture.task_bytes", driver.captured_bytes)
+    metrics.observe("capture.task_requests", driver.captured_requests)
+    logging.info(
+        f"Captured {driver.captured_requests} responses, "
+        f"{driver.captured_bytes / 1024:.0f} KB of bodies"
+    )
+    del driver.requests
+    driver.captured_requests = 0
+    driver.captured_bytes = 0
+    driver.scopes = IDLE_SCOPES
+
+
+def replay_source(request):
+    # 转换成 /scrap/list/json 可以直接使用的参数, 无法重放的请求返回 None
+    method = request.method.upper()
+    if method == "GET":
+        return {"url": request.url, "payload": None, "payload_type": "json"}
+    if method != "POST":
+        return None
+
+    content_type = (request.headers.get("Content-Type") or "").lower()
+    body = (request.body or b"").decode("utf-8", errors="replace")
+    if "json" in content_type:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict):
+            return None
+        return {"url": request.url, "payload": payload, "payload_type": "json"}
+    if "x-www-form-urlencoded" in content_type:
+        payload = dict(parse_qsl(body))
+        return {"url": request.url, "payload": payload, "payload_type": "form"}
+    return None
+
+
+def captured_json_responses(driver):
+    # 返回 [(source, json_data)], 只包含成功且可以重放的 JSON 响应
+    responses = []
+    for request in driver.requests:
+        response = request.response
+        if response is None or response.status_code != 200 or not response.body:
+            continue
+        if not is_json_response(response):
+            continue
+        source = replay_source(request)
+        if source is None:
+            continue
+        try:
+            body = decode(
+                response.body, response.headers.get("Content-Encoding", "identity")
+            )
+            responses.append((source, json.loads(body)))
+        except ValueError:
+            continue
+
+    logging.info(f"Captured {len(responses)} JSON responses")
+    return responses
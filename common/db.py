@@ -0,0 +1,16 @@
+import os
+import sqlite3
+
+# 本地状态(模板/缓存/任务等)统一放在 DATA_DIR 下的 SQLite 文件中
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+
+def connect(name):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(
+        os.path.join(DATA_DIR, name), check_same_thread=False, isolation_level=None
+    )
+    # WAL 模式允许主进程和 worker 进程同时读写
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+from contextlib import contextmanager
+from multiprocessing import util as mp_util
+from urllib.parse import urlparse
+from common import blocking, capture, metrics, readiness, utils
+from common.worker_pool import get_rss_mb
+
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "1"))
+# 每个 Chrome 处理 N 个页面后重启, 或者进程树内存超过上限后重启
+DRIVER_MAX_PAGES = int(os.getenv("DRIVER_MAX_PAGES", "20"))
+DRIVER_MAX_RSS_MB = int(os.getenv("DRIVER_MAX_RSS_MB", "2048"))
+DRIVER_PRELOAD = os.getenv("DRIVER_PRELOAD", "1") == "1"
+
+
+def get_process_tree_rss_mb(pid):
+    # chromedriver -> chrome -> renderer/gpu 等子进程的内存总和
+    total = 0.0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        total += get_rss_mb(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def reset_driver(driver):
+    # 清理上一个任务留下的状态, 代替重启浏览器
+    # 先读出剩余的网络事件, 补全本次任务访问过的源(重定向目标、跨域 iframe)
+    readiness.drain_network_events(driver)
+    origins = set(driver.visited_origins)
+    parsed = urlparse(driver.current_url)
+    if parsed.scheme in ("http", "https"):
+        origins.add(f"{parsed.scheme}://{parsed.netloc}")
+    for origin in origins:
+        driver.execute_cdp_cmd(
+            "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"}
+        )
+    # HTTP 缓存不区分源, 整体清空
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.get("about:blank")
+    driver.delete_all_cookies()
+    driver.set_window_size(1920, 1080)
+    driver.blocking_profile = blocking.BLOCKING_PROFILE
+    # 丢弃上一个任务遗留的网络事件
+    readiness.drain_network_events(driver)
+    driver.visited_origins = set()
+
+
+class DriverPool:
+    def __init__(self, size=DRIVER_POOL_SIZE):
+        self.size = size
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.drivers = set()
+        self.launching = 0
+
+    def start(self):
+        utils.resolve_driver_path()
+        for _ in range(self.size):
+            with self.lock:
+                self.launching += 1
+            self._launch_into_idle()
+
+    def close(self):
+        with self.lock:
+            drivers = list(self.drivers)
+            self.drivers.clear()
+        for driver in drivers:
+            utils.clean_up_driver(driver, driver.temp_dirs)
+
+    def _launch(self):
+        start_time = time.perf_counter()
+        driver, temp_dirs = utils.get_driver()
+        driver.temp_dirs = temp_dirs
+        driver.pages = 0
+
+        launch_time = time.perf_counter() - start_time
+        metrics.observe("driver.launch_seconds", launch_time)
+        metrics.incr("driver.launched")
+        logging.info(f"Launched Chrome in {launch_time:.2f} seconds")
+
+        with self.lock:
+            self.drivers.add(driver)
+        return driver
+
+    def _launch_into_idle(self):
+        try:
+            self.idle.put(self._launch())
+        except Exception as e:
+            logging.error(f"Error launching pooled driver: {e}")
+        finally:
+            with self.lock:
+                self.launching -= 1
+
+    def _get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            can_launch = len(self.drivers) + self.launching < self.size
+            if can_launch:
+                self.launching += 1
+        if can_launch:
+            try:
+                return self._launch()
+            finally:
+                with self.lock:
+                    self.launching -= 1
+        return self.idle.get()
+
+    def _retire(self, driver, reason):
+        logging.info(f"Recycle driver after {driver.pages} pages: {reason}")
+        metrics.incr("driver.recycled")
+        with self.lock:
+            self.drivers.discard(driver)
+            self.launching += 1
+        utils.clean_up_driver(driver, driver.temp_dirs)
+        # 在后台补充一个新的浏览器, 不占用当前任务的时间
+        threading.Thread(target=self._launch_into_idle, daemon=True).start()
+
+    def _release(self, driver):
+        driver.pages += 1
+        try:
+            # 记录本次任务捕获的数据量, 并清空 selenium-wire 的存储
+            capture.record_task(driver)
+        except Exception as e:
+            logging.info(f"Error clearing captured requests: {e}")
+
+        if driver.pages >= DRIVER_MAX_PAGES:
+            self._retire(driver, "max pages reached")
+            return
+
+        rss = get_process_tree_rss_mb(driver.service.process.pid)
+        if rss > DRIVER_MAX_RSS_MB:
+            self._retire(driver, f"rss {rss:.0f} MB over limit")
+            return
+
+        try:
+            reset_driver(driver)
+        except Exception as e:
+            self._retire(driver, f"reset failed: {e}")
+            return
+        self.idle.put(driver)
+
+    @contextmanager
+    def acquire(self):
+        start_time = time.perf_counter()
+        driver = self._get()
+        metrics.observe("driver.queue_wait_seconds", time.perf_counter() - start_time)
+        try:
+            yield driver
+        finally:
+            self._release(driver)
+
+
+pool = DriverPool()
+# worker 进程退出时关闭所有浏览器
+mp_util.Finalize(None, pool.close, exitpriority=10)
+
+
+def acquire():
+    return pool.acquire()
@@ -0,0 +1,374 @@
+import os
+import re
+import json
+import asyncio
+import logging
+
+from common import llm, llm_cache, metrics, utils, preprocess, templates
+
+# 批量模式: 把多个列表项打包进一个 prompt, 让模型返回 JSON 数组
+LLM_BATCH_MODE = os.getenv("LLM_BATCH_MODE", "1") == "1"
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "6000"))
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "20"))
+
+EXPECTED_FIELDS = [
+    "name",
+    "image",
+    "description",
+    "brand",
+    "price",
+    "collection",
+    "reference",
+    "url",
+]
+
+
+def build_conditions(domain, detail_url_template=None, price_with_currency=False):
+    conditions = [
+        f"the expected fields are {', '.join(EXPECTED_FIELDS[:-1])}, url(with domain:{domain})",
+        "if one of the fields is missing, set it to null",
+        "don't give me the code, just give me the json result, no need for more explanation",
+        "The image and url must be a full address starting with http or https",
+    ]
+    if price_with_currency:
+        conditions.append("The price should be with currency symbol")
+    if detail_url_template:
+        conditions.append(f"And here is a detail url template: {detail_url_template}")
+
+    return "There are a few conditions you have to follow:\n\n" + "\n".join(
+        f"{i}, {condition}" for i, condition in enumerate(conditions, start=1)
+    )
+
+
+# 价格统一为"货币符号 + 金额", 例如 $1,250 / €980.50 / CHF 3,400, LLM 和模板的结果格式一致
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "INR": "₹", "KRW": "₩"}
+_SYMBOL_CURRENCIES = [
+    ("US$", "USD"),
+    ("HK$", "HKD"),
+    ("S$", "SGD"),
+    ("A$", "AUD"),
+    ("C$", "CAD"),
+    ("$", "USD"),
+    ("€", "EUR"),
+    ("£", "GBP"),
+    ("¥", "JPY"),
+    ("₹", "INR"),
+    ("₩", "KRW"),
+]
+# 只把这些 ISO 4217 代码识别为货币, 避免 "NEW 1,200" / "FOB 300" 之类的单词被当成货币
+CURRENCY_CODES = {currency for _, currency in _SYMBOL_CURRENCIES} | set(
+    """
+    CHF CNY NZD SEK NOK DKK PLN CZK HUF TRY RUB AED SAR QAR KWD ILS ZAR BRL MXN
+    TWD THB MYR IDR PHP VND
+    """.split()
+)
+
+
+def _parse_amount(text):
+    # 兼容 1,234.56 / 1.234,56 / 1 234 / 1'234 等写法
+    number = re.sub(r"[\s']", "", text)
+    if "," in number and "." in number:
+        decimal = "," if number.rfind(",") > number.rfind(".") else "."
+    elif re.fullmatch(r"\d+[.,]\d{1,2}", number):
+        decimal = number[-2] if number[-2] in ",." else number[-3]
+    else:
+        decimal = None
+    thousands = {",", "."} - {decimal}
+    for separator in thousands:
+        number = number.replace(separator, "")
+    if decimal == ",":
+        number = number.replace(",", ".")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def normalize_price(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        text, amount = str(value), float(value)
+    else:
+        text = str(value).strip()
+        match = re.search(r"\d(?:[\d.,'\s]*\d)?", text)
+        amount = _parse_amount(match.group(0)) if match else None
+    if amount is None:
+        return text or None
+
+    currency = None
+    codes = [
+        code.upper()
+        for code in re.findall(r"\b[A-Za-z]{3}\b", text)
+        if code.upper() in CURRENCY_CODES
+    ]
+    if codes:
+        currency = codes[0]
+    else:
+        for symbol, symbol_currency in _SYMBOL_CURRENCIES:
+            if symbol in text:
+                currency = symbol_currency
+                break
+
+    formatted = f"{amount:,.2f}" if amount % 1 else f"{amount:,.0f}"
+    if currency is None:
+        return formatted
+    if currency in CURRENCY_SYMBOLS:
+        return f"{CURRENCY_SYMBOLS[currency]}{formatted}"
+    return f"{currency} {formatted}"
+
+
+def normalize_listing(listing):
+    # 只保留约定的字段, 缺失的字段为 None
+    normalized = {field: listing.get(field) for field in EXPECTED_FIELDS}
+    normalized["price"] = normalize_price(normalized["price"])
+    return normalized
+
+
+def is_valid_listing(listing):
+    if not isinstance(listing, dict):
+        return False
+    return any(listing.get(field) for field in ("name", "price", "reference"))
+
+
+def parse_json_array(content):
+    if content is None:
+        return None
+    match = re.search(r"```(?:json)?\n(.*?)\n```", content, re.DOTALL)
+    if match:
+        content = match.group(1)
+    start = content.find("[")
+    end = content.rfind("]")
+    if start == -1 or end <= start:
+        return None
+    try:
+        result = json.loads(content[start : end + 1])
+    except json.JSONDecodeError:
+        return None
+    return result if isinstance(result, list) else None
+
+
+def _pack_batches(items, overhead_tokens):
+    # 按 token 预算把列表项切分成若干批, 单个超出预算的项目单独成批
+    batches = []
+    batch = []
+    batch_tokens = overhead_tokens
+    for index, item in enumerate(items):
+        item_tokens = llm.estimate_tokens(item) + 10
+        if batch and (
+            batch_tokens + item_tokens > LLM_BATCH_TOKEN_BUDGET
+            or len(batch) >= LLM_BATCH_MAX_ITEMS
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = overhead_tokens
+        batch.append(index)
+        batch_tokens += item_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _build_batch_prompt(items, indexes, kind, conditions):
+    blocks = "\n\n".join(f"### ITEM {index}\n{items[index]}" for index in indexes)
+    return (
+        f"Try extract the watch data from each of the following {kind} items, "
+        + 'every item starts with a line "### ITEM <index>":\n\n'
+        + blocks
+        + "\n\n"
+        + conditions
+        + '\n\nReturn a json array with one object for every item, each object must have an "index" field with the item index.'
+    )
+
+
+async def _extract_batch(items, indexes, kind, conditions, model):
+    prompt = _build_batch_prompt(items, indexes, kind, conditions)
+    try:
+        content = await llm.complete(
+            [
+                {
+                    "role": "system",
+                    "content": "Assistant is a large language model trained by OpenAI.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            model=model,
+            temperature=0,
+            top_p=1.0,
+            frequency_penalty=0,
+            presence_penalty=0,
+        )
+    except Exception as e:
+        logging.info(f"Batch extraction failed: {e}")
+        return {}
+
+    # 按 index 把结果对应回原来的列表项
+    results = {}
+    wanted = set(indexes)
+    for listing in parse_json_array(content) or []:
+        if not isinstance(listing, dict):
+            continue
+        try:
+            index = int(listing.pop("index"))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if index in wanted and is_valid_listing(listing):
+            results[index] = listing
+    return results
+
+
+async def _extract_single(item, kind, conditions, model):
+    try:
+        extracted = await utils.extractWithOpenAI(
+            f"Try extract the watch data from the following {kind}: "
+            + item
+            + "\n\n"
+            + conditions,
+            model=model,
+        )
+        return json.loads(extracted) if extracted is not None else None
+    except Exception as e:
+        logging.info(f"Extraction failed: {e}")
+        return None
+
+
+async def _extract_with_llm(items, kind, conditions, model):
+    # 返回 {列表项下标: 提取结果}
+    if not items:
+        return {}
+
+    # 去掉无关标记并按 token 预算截断, 减少 prompt 长度
+    items, tokens_before, tokens_after = preprocess.prepare_items(items, kind)
+    metrics.incr("preprocess.tokens_saved", tokens_before - tokens_after)
+    logging.info(
+        f"Preprocess {len(items)} items: {tokens_before} -> {tokens_after} tokens, saved {tokens_before - tokens_after}"
+    )
+
+    # 先查缓存; 相同片段正在被其他请求提取时等待它的结果
+    loop = asyncio.get_running_loop()
+    keys = [llm_cache.make_key(item, conditions, model) for item in items]
+    # 一批 key 只查一次 SQLite, 并且放到线程里执行, 不阻塞事件循环
+    cached = await asyncio.to_thread(llm_cache.get_many, keys)
+    results = {}
+    owned = []
+    waiting = {}
+    for index, key in enumerate(keys):
+        if key in cached:
+            results[index] = cached[key]
+        elif key in llm_cache.inflight:
+            waiting[index] = llm_cache.inflight[key]
+        else:
+            llm_cache.inflight[key] = loop.create_future()
+            owned.append(index)
+
+    try:
+        extracted = await _extract_uncached(
+            [items[index] for index in owned], kind, conditions, model
+        )
+        for position, listing in extracted.items():
+            results[owned[position]] = listing
+    finally:
+        for index in owned:
+            future = llm_cache.inflight.pop(keys[index], None)
+            if future is not None and not future.done():
+                future.set_result(results.get(index))
+
+    await asyncio.to_thread(
+        llm_cache.put_many,
+        [(keys[owned[position]], listing) for position, listing in extracted.items()],
+    )
+
+    for index, future in waiting.items():
+        listing = await future
+        if listing is not None:
+            results[index] = listing
+
+    return results
+
+
+async def _extract_uncached(items, kind, conditions, model):
+    results = {}
+    if not items:
+        return results
+
+    if LLM_BATCH_MODE and len(items) > 1:
+        overhead_tokens = llm.estimate_tokens(
+            _build_batch_prompt(items, [], kind, conditions)
+        )
+        batches = _pack_batches(items, overhead_tokens)
+        for batch_results in await asyncio.gather(
+            *[
+                _extract_batch(items, indexes, kind, conditions, model)
+                for indexes in batches
+            ]
+        ):
+            results.update(batch_results)
+        metrics.incr("extraction.batch_calls", len(batches))
+        logging.info(
+            f"Batch extraction: {len(items)} items in {len(batches)} calls, {len(results)} valid"
+        )
+
+    # 批量结果校验失败的项目才逐个调用
+    missing = [index for index in range(len(items)) if index not in results]
+    singles = await asyncio.gather(
+        *[_extract_single(items[index], kind, conditions, model) for index in missing]
+    )
+    metrics.incr("extraction.single_calls", len(missing))
+    for index, listing in zip(missing, singles):
+        if listing is not None:
+            results[index] = listing
+
+    return results
+
+
+def _apply_template(template, domain, kind, items):
+    results = {}
+    for index, item in enumerate(items):
+        listing = templates.apply(template, domain, kind, item)
+        if templates.is_valid_listing(listing):
+            results[index] = listing
+    return results
+
+
+async def extract_listings(items, kind, conditions, model="gpt-4", domain=None):
+    results = await extract_listing_map(items, kind, conditions, model, domain)
+    return [results[index] for index in range(len(items)) if index in results]
+
+
+async def extract_listing_map(items, kind, conditions, model="gpt-4", domain=None):
+    # 返回 {列表项下标: 提取结果}, 提取失败的列表项不在结果中
+    if not items:
+        return {}
+
+    results = {}
+    template = templates.load(domain, kind) if domain else None
+    if template is not None:
+        # 已经学习过这个域名的模板, 直接用选择器提取, 校验失败的才交给 LLM
+        results = _apply_template(template, domain, kind, items)
+        failures = len(items) - len(results)
+        metrics.incr("templates.hits", len(results))
+        metrics.incr("templates.misses", failures)
+        logging.info(f"Template extraction: {len(results)}/{len(items)} items")
+
+        if failures > len(items) * templates.TEMPLATE_MAX_FAILURE_RATIO:
+            # 页面结构变了, 模板作废, 全部交给 LLM 并重新学习
+            templates.invalidate(domain, kind)
+            template = None
+            results = {}
+
+    missing = [index for index in range(len(items)) if index not in results]
+    extracted = await _extract_with_llm(
+        [items[index] for index in missing], kind, conditions, model
+    )
+    for position, listing in extracted.items():
+        results[missing[position]] = listing
+
+    if domain and template is None and extracted:
+        samples = [
+            (items[missing[position]], listing)
+            for position, listing in extracted.items()
+        ]
+        templates.learn(domain, kind, samples)
+
+    # 模板和 LLM 的结果统一字段和价格格式, 学到模板前后结果一致
+    return {index: normalize_listing(listing) for index, listing in results.items()}
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from common import db, metrics, llm_cache
+
+# 每个列表地址上一次抓取的状态: ETag/Last-Modified、响应体哈希和每个列表项的提取结果
+# 重复抓取时发送条件请求, 内容没变就直接返回上次的结果, 只有新增或变化的列表项才交给提取
+FETCH_STATE_ENABLED = os.getenv("FETCH_STATE_ENABLED", "1") == "1"
+FETCH_STATE_MAX_AGE_SECONDS = int(
+    os.getenv("FETCH_STATE_MAX_AGE_SECONDS", str(7 * 86400))
+)
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = db.connect("fetch_state.db")
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fetch_state (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body_hash TEXT NOT NULL,
+                    item_hashes TEXT NOT NULL,
+                    listings TEXT NOT NULL,
+                    parent TEXT,
+                    s3_uuid TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+    return _conn
+
+
+def make_key(kind, info):
+    # 请求参数和提取条件都相同才能复用上一次的结果
+    payload = json.dumps(
+        [
+            kind,
+            info.url,
+            info.payload,
+            info.payload_type,
+            info.response_key,
+            info.detail_url_template,
+            llm_cache.PROMPT_VERSION,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_body(body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha256(body).hexdigest()
+
+
+def hash_item(item):
+    normalized = " ".join(item.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def is_success(response):
+    return 200 <= response.status_code < 300
+
+
+def _extracted_listings(state):
+    # 旧版本会把提取失败的结果保存为 None, 这些列表项需要重新提取
+    if state is None:
+        return {}
+    return {
+        item_hash: listing
+        for item_hash, listing in state["listings"].items()
+        if listing is not None
+    }
+
+
+def is_complete(state):
+    # 上次有列表项提取失败时不能直接复用结果, 需要重新获取内容并提取这些列表项
+    listings = _extracted_listings(state)
+    return all(item_hash in listings for item_hash in state["item_hashes"])
+
+
+def is_unchanged(state, response, body_hash):
+    # 304, 或者 2xx 且响应体和上次相同; 错误页面不能当作内容没变
+    if state is None or not is_complete(state):
+        return False
+    if response.status_code == 304:
+        return True
+    return is_success(response) and body_hash == state["body_hash"]
+
+
+def load(key):
+    if not FETCH_STATE_ENABLED:
+        return None
+
+    row = (
+        _get_conn()
+        .execute(
+            """
+            SELECT etag, last_modified, body_hash, item_hashes, listings, parent,
+                   s3_uuid, updated_at
+            FROM fetch_state WHERE key = ?
+            """,
+            (key,),
+        )
+        .fetchone()
+    )
+    if row is None or time.time() - row[7] > FETCH_STATE_MAX_AGE_SECONDS:
+        return None
+
+    return {
+        "etag": row[0],
+        "last_modified": row[1],
+        "body_hash": row[2],
+        "item_hashes": json.loads(row[3]),
+        "listings": json.loads(row[4]),
+        "parent": json.loads(row[5]),
+        "s3_uuid": row[6],
+    }
+
+
+def save(key, url, response, body_hash, item_hashes, listings, parent, s3_uuid):
+    # 只保存 2xx 响应, 错误页面不能覆盖上一次正常的状态
+    if not FETCH_STATE_ENABLED or not is_success(response):
+        return
+
+    _get_conn().execute(
+        """
+        INSERT OR REPLACE INTO fetch_state (
+            key, url, etag, last_modified, body_hash, item_hashes, listings,
+            parent, s3_uuid, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            key,
+            url,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            body_hash,
+            json.dumps(item_hashes),
+            json.dumps(listings),
+            json.dumps(parent),
+            s3_uuid,
+            time.time(),
+        ),
+    )
+
+
+def conditional_headers(state):
+    headers = {}
+    if state is None or not is_complete(state):
+        return headers
+    if state["etag"]:
+        headers["If-None-Match"] = state["etag"]
+    if state["last_modified"]:
+        headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+
+def previous_result(state):
+    # 内容没有变化时, 按上次的顺序返回上次的提取结果
+    listings = [
+        state["listings"].get(item_hash) for item_hash in state["item_hashes"]
+    ]
+    return [listing for listing in listings if listing is not None]
+
+
+def split_items(state, items):
+    # 返回 (每个列表项的哈希, 需要重新提取的列表项下标)
+    previous = _extracted_listings(state)
+    item_hashes = [hash_item(item) for item in items]
+    seen = set()
+    changed = []
+    for index, item_hash in enumerate(item_hashes):
+        if item_hash not in previous and item_hash not in seen:
+            changed.append(index)
+        seen.add(item_hash)
+
+    metrics.incr("fetch_state.items_reused", len(items) - len(changed))
+    metrics.incr("fetch_state.items_changed", len(changed))
+    return item_hashes, changed
+
+
+def merge_listings(state, item_hashes, changed, extracted):
+    # extracted 为 {changed 中的位置: 提取结果}, 返回 (要保存的结果表, 按顺序的提取结果)
+    previous = _extracted_listings(state)
+    listings = {
+        item_hash: previous[item_hash]
+        for item_hash in item_hashes
+        if item_hash in previous
+    }
+    # 提取失败(LLM 限流/超时等)的列表项不记录, 下次抓取时重新提取
+    for position, index in enumerate(changed):
+        if extracted.get(position) is not None:
+            listings[item_hashes[index]] = extracted[position]
+
+    output = [listings.get(item_hash) for item_hash in item_hashes]
+    return listings, [listing for listing in output if listing is not None]
@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+
+from urllib.parse import urlparse
+from common import metrics
+
+# 抓取目标站点时共用长连接客户端(按代理区分), 避免每次请求重新建立 DNS/TCP/TLS 连接
+FETCH_HTTP2 = os.getenv("FETCH_HTTP2", "1") == "1"
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "100"))
+FETCH_MAX_KEEPALIVE = int(os.getenv("FETCH_MAX_KEEPALIVE", "40"))
+FETCH_KEEPALIVE_EXPIRY = float(os.getenv("FETCH_KEEPALIVE_EXPIRY", "60"))
+FETCH_MAX_PER_HOST = int(os.getenv("FETCH_MAX_PER_HOST", "8"))
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "10"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "30"))
+FETCH_MAX_BODY_BYTES = int(os.getenv("FETCH_MAX_BODY_BYTES", str(20 * 1024 * 1024)))
+
+_clients = {}
+_host_semaphores = {}
+_host_stats = {}
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+def get_client(proxy=None):
+    if proxy not in _clients:
+        _clients[proxy] = httpx.AsyncClient(
+            proxy=proxy,
+            verify=False,
+            http2=FETCH_HTTP2,
+            limits=httpx.Limits(
+                max_connections=FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=FETCH_MAX_KEEPALIVE,
+                keepalive_expiry=FETCH_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                FETCH_READ_TIMEOUT,
+                connect=FETCH_CONNECT_TIMEOUT,
+                pool=FETCH_CONNECT_TIMEOUT,
+            ),
+        )
+        logging.info(f"Created fetch client, proxy={proxy}, http2={FETCH_HTTP2}")
+    return _clients[proxy]
+
+
+async def close():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+    _host_semaphores.clear()
+
+
+def _get_host_semaphore(host):
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(FETCH_MAX_PER_HOST)
+    return _host_semaphores[host]
+
+
+def _record(host, new_connections, http_version):
+    stats = _host_stats.setdefault(
+        host, {"requests": 0, "new_connections": 0, "http2": 0}
+    )
+    stats["requests"] += 1
+    stats["new_connections"] += new_connections
+    if http_version == "HTTP/2":
+        stats["http2"] += 1
+
+
+def stats():
+    # 每个站点的连接复用情况
+    return {
+        host: {
+            **host_stats,
+            "reuse_ratio": 1 - host_stats["new_connections"] / host_stats["requests"],
+        }
+        for host, host_stats in _host_stats.items()
+        if host_stats["requests"]
+    }
+
+
+async def request(method, url, **kwargs):
+    # 从环境变量获取代理, 相同代理共用同一个客户端
+    client = get_client(os.getenv("PROXY") or None)
+    host = urlparse(url).netloc
+    new_connections = 0
+
+    async def trace(event_name, info):
+        nonlocal new_connections
+        # httpcore 只有在新建连接时才会触发 connect_tcp 事件
+        if event_name == "connection.connect_tcp.complete":
+            new_connections += 1
+
+    start_time = time.perf_counter()
+    async with _get_host_semaphore(host):
+        http_request = client.build_request(
+            method, url, extensions={"trace": trace}, **kwargs
+        )
+        response = await client.send(http_request, stream=True)
+        try:
+            # 边读边解压边检查大小, 按解压后的大小限制, 压缩炸弹也不会被完整读进内存
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > FETCH_MAX_BODY_BYTES:
+                    metrics.incr("fetch.too_large")
+                    raise ResponseTooLarge(
+                        f"Response from {url} exceeds {FETCH_MAX_BODY_BYTES} bytes"
+                    )
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+
+    metrics.observe("fetch.seconds", time.perf_counter() - start_time)
+    _record(host, new_connections, response.http_version)
+
+    # 用解压后的内容重新构造响应, 去掉 Content-Encoding/Content-Length 避免再次解压
+    headers = response.headers.copy()
+    headers.pop("Content-Encoding", None)
+    headers.pop("Content-Length", None)
+    return httpx.Response(
+        status_code=response.status_code,
+        headers=headers,
+        content=b"".join(chunks),
+        request=response.request,
+        extensions={"http_version": response.http_version.encode("ascii")},
+    )
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+async def fetch_info(info, headers=None):
+    # 按 ScrapListInfo 的 payload/payload_type 请求目标地址
+    if info.payload is None:
+        return await get(info.url, headers=headers)
+    if info.payload_type == "form":
+        # 将 payload 转换为符合 multipart/form-data 的格式，确保所有字段都是字符串
+        form_data = {key: str(value) for key, value in info.payload.items()}
+        return await post(info.url, data=form_data, headers=headers)
+    return await post(info.url, json=info.payload, headers=headers)
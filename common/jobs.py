@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import httpx
+
+from common import db, metrics, worker_pool
+
+# 长时间运行的抓取任务放进优先级队列, 提交后立即返回任务 id, 通过状态接口或 webhook 获取结果
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", str(worker_pool.WORKER_POOL_SIZE)))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "50"))
+# 队列满时先记录在 SQLite 中延后执行, 延后的任务也满了才拒绝
+JOB_MAX_DEFERRED = int(os.getenv("JOB_MAX_DEFERRED", "500"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", str(7 * 86400)))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+# 失败的任务重新排队, 最多执行的次数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+
+QUEUED = "queued"
+DEFERRED = "deferred"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_handlers = {}
+_queue = None
+_workers = []
+_sequence = 0
+_webhook_client = None
+
+_lock = threading.Lock()
+_conn = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = db.connect("jobs.db")
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    webhook TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            columns = [row[1] for row in _conn.execute("PRAGMA table_info(jobs)")]
+            if "attempts" not in columns:
+                _conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+                )
+            _conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at)"
+            )
+    return _conn
+
+
+def register(kind, handler):
+    # handler 为 async 函数, 接收提交时的请求参数(dict), 返回可以序列化为 JSON 的结果
+    _handlers[kind] = handler
+
+
+def _set_status(job_id, status, **fields):
+    columns = ", ".join(f"{column} = ?" for column in ["status", *fields])
+    _get_conn().execute(
+        f"UPDATE jobs SET {columns} WHERE id = ?",
+        (status, *fields.values(), job_id),
+    )
+
+
+def _count(status):
+    return (
+        _get_conn()
+        .execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
+        .fetchone()[0]
+    )
+
+
+def _enqueue(job_id, priority):
+    # 数字越大越先执行, 相同优先级按提交顺序
+    global _sequence
+    _sequence += 1
+    _queue.put_nowait((-priority, _sequence, job_id))
+
+
+def _refill():
+    # 队列有空位时, 按优先级把延后的任务放回队列
+    space = JOB_QUEUE_SIZE - _queue.qsize()
+    if space <= 0:
+        return
+    rows = (
+        _get_conn()
+        .execute(
+            """
+            SELECT id, priority FROM jobs WHERE status = ?
+            ORDER BY priority DESC, created_at LIMIT ?
+            """,
+            (DEFERRED, space),
+        )
+        .fetchall()
+    )
+    for job_id, priority in rows:
+        _set_status(job_id, QUEUED)
+        _enqueue(job_id, priority)
+
+
+def submit(kind, request, priority=0, webhook=None):
+    # 返回 (任务 id, 状态), 队列和延后名额都满时抛出 QueueFull
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    deferred = _count(DEFERRED)
+    if _queue.full() and deferred >= JOB_MAX_DEFERRED:
+        metrics.incr("jobs.rejected")
+        raise QueueFull(f"Job queue is full ({JOB_QUEUE_SIZE} queued)")
+
+    job_id = str(uuid.uuid4())
+    _get_conn().execute(
+        """
+        INSERT INTO jobs (id, kind, priority, status, request, webhook, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (job_id, kind, priority, DEFERRED, json.dumps(request), webhook, time.time()),
+    )
+    if deferred or _queue.full():
+        # 已经有延后的任务时统一按优先级放回队列, 新任务不能插到它们前面
+        _refill()
+    else:
+        _set_status(job_id, QUEUED)
+        _enqueue(job_id, priority)
+
+    status = get(job_id)["status"]
+    metrics.incr(f"jobs.{status}")
+    return job_id, status
+
+
+def get(job_id):
+    row = (
+        _get_conn()
+        .execute(
+            """
+            SELECT id, kind, priority, status, result, error, attempts, created_at,
+                   started_at, finished_at
+            FROM jobs WHERE id = ?
+            """,
+            (job_id,),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    return {
+        "job_id": row[0],
+        "kind": row[1],
+        "priority": row[2],
+        "status": row[3],
+        "result": json.loads(row[4]) if row[4] is not None else None,
+        "error": row[5],
+        "attempts": row[6],
+        "created_at": row[7],
+        "started_at": row[8],
+        "finished_at": row[9],
+    }
+
+
+async def _notify(webhook, job):
+    global _webhook_client
+    if _webhook_client is None:
+        _webhook_client = httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT)
+
+    for attempt in range(JOB_WEBHOOK_RETRIES):
+        try:
+            response = await _webhook_client.post(webhook, json=job)
+            response.raise_for_status()
+            metrics.incr("jobs.webhook_sent")
+            return
+        except httpx.HTTPError as e:
+            logging.info(f"Webhook {webhook} failed (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(2**attempt)
+    metrics.incr("jobs.webhook_failed")
+
+
+async def _run(job_id):
+    row = (
+        _get_conn()
+        .execute(
+            "SELECT kind, request, webhook, attempts, created_at FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return
+    kind, request, webhook, attempts, created_at = row
+
+    started_at = time.time()
+    attempts += 1
+    metrics.observe("jobs.queue_wait_seconds", started_at - created_at)
+    _set_status(job_id, RUNNING, started_at=started_at, attempts=attempts)
+    try:
+        result = await _handlers[kind](json.loads(request))
+    except Exception as e:
+        metrics.observe("jobs.run_seconds", time.time() - started_at)
+        if attempts < JOB_MAX_ATTEMPTS:
+            # 放回延后队列, 队列有空位时按优先级重新执行
+            logging.info(f"Job {job_id} failed (attempt {attempts}), retrying: {e}")
+            _set_status(job_id, DEFERRED, error=str(e))
+            metrics.incr("jobs.retried")
+            return
+        logging.error(f"Job {job_id} failed: {e}")
+        _set_status(job_id, FAILED, error=str(e), finished_at=time.time())
+        metrics.incr("jobs.failed")
+    else:
+        metrics.observe("jobs.run_seconds", time.time() - started_at)
+        _set_status(
+            job_id,
+            SUCCEEDED,
+            result=json.dumps(result),
+            error=None,
+            finished_at=time.time(),
+        )
+        metrics.incr("jobs.succeeded")
+
+    if webhook:
+        await _notify(webhook, get(job_id))
+
+
+async def _worker():
+    while True:
+        _, _, job_id = await _queue.get()
+        try:
+            await _run(job_id)
+        except Exception as e:
+            logging.error(f"Error running job {job_id}: {e}")
+        finally:
+            _queue.task_done()
+            _refill()
+
+
+def start():
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.PriorityQueue(maxsize=JOB_QUEUE_SIZE)
+
+    conn = _get_conn()
+    conn.execute(
+        "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+        (time.time() - JOB_RESULT_TTL_SECONDS,),
+    )
+    # 上次进程退出时没有完成的任务重新排队
+    conn.execute(
+        "UPDATE jobs SET status = ? WHERE status IN (?, ?)",
+        (DEFERRED, QUEUED, RUNNING),
+    )
+    _refill()
+    logging.info(
+        f"Job queue started, {_queue.qsize()} queued, {_count(DEFERRED)} deferred"
+    )
+
+    for _ in range(JOB_CONCURRENCY):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop():
+    # 正在执行的任务保持 running 状态, 下次启动时重新排队
+    global _queue, _webhook_client
+    for worker in _workers:
+        worker.cancel()
+    _workers.clear()
+    _queue = None
+    if _webhook_client is not None:
+        await _webhook_client.aclose()
+        _webhook_client = None
+
+
+def stats():
+    return {
+        "concurrency": JOB_CONCURRENCY,
+        "queued": _queue.qsize() if _queue else 0,
+        "deferred": _count(DEFERRED),
+        "max_queued": JOB_QUEUE_SIZE,
+        "max_deferred": JOB_MAX_DEFERRED,
+    }
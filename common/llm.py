@@ -0,0 +1,178 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import httpx
+
+from openai import (
+    AsyncAzureOpenAI,
+    APIConnectionError,
+    APIStatusError,
+    RateLimitError,
+)
+from common import metrics, preprocess
+
+# 所有请求共用一个客户端, 并限制整体和单个部署的并发
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_DEPLOYMENT_CONCURRENCY = int(os.getenv("OPENAI_DEPLOYMENT_CONCURRENCY", "8"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "60"))
+# 预估每次回复占用的 token 数, 用于 TPM 限流
+OPENAI_COMPLETION_TOKENS = int(os.getenv("OPENAI_COMPLETION_TOKENS", "500"))
+
+_client = None
+_global_semaphore = None
+_deployment_semaphores = {}
+_buckets = {}
+
+
+def _get_deployment_limit(name, deployment, default):
+    # 例如 OPENAI_RPM_LIMIT_GPT_4 优先于 OPENAI_RPM_LIMIT
+    key = f"{name}_{deployment.upper().replace('-', '_').replace('.', '_')}"
+    return int(os.getenv(key, os.getenv(name, default)))
+
+
+def estimate_tokens(text):
+    return preprocess.count_tokens(text)
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def get_client():
+    global _client, _global_semaphore
+    if _client is None:
+        _client = AsyncAzureOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            api_version=os.getenv("OPENAI_API_VERSION", ""),
+            azure_endpoint=os.getenv("OPENAI_AZURE_ENDPOINT", ""),
+            # 重试由下面的 complete 负责
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONCURRENCY,
+                    max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+                ),
+                timeout=OPENAI_TIMEOUT,
+            ),
+        )
+        _global_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+    _deployment_semaphores.clear()
+    _buckets.clear()
+
+
+def _get_deployment_limiters(model):
+    if model not in _deployment_semaphores:
+        concurrency = _get_deployment_limit(
+            "OPENAI_DEPLOYMENT_CONCURRENCY", model, OPENAI_DEPLOYMENT_CONCURRENCY
+        )
+        _deployment_semaphores[model] = asyncio.Semaphore(concurrency)
+        rpm = _get_deployment_limit("OPENAI_RPM_LIMIT", model, "0")
+        tpm = _get_deployment_limit("OPENAI_TPM_LIMIT", model, "0")
+        # 0 表示不限制
+        _buckets[model] = (
+            TokenBucket(rpm) if rpm > 0 else None,
+            TokenBucket(tpm) if tpm > 0 else None,
+        )
+    return _deployment_semaphores[model], _buckets[model]
+
+
+def _get_retry_after(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    retry_after_ms = response.headers.get("retry-after-ms")
+    retry_after = response.headers.get("retry-after")
+    try:
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        return None
+    return None
+
+
+def _is_retryable(e):
+    if isinstance(e, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+async def complete(messages, model, **kwargs):
+    client = get_client()
+    deployment_semaphore, (rpm_bucket, tpm_bucket) = _get_deployment_limiters(model)
+    tokens = (
+        sum(estimate_tokens(message["content"]) for message in messages)
+        + OPENAI_COMPLETION_TOKENS
+    )
+
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        start_time = time.perf_counter()
+        if rpm_bucket is not None:
+            await rpm_bucket.acquire()
+        if tpm_bucket is not None:
+            await tpm_bucket.acquire(tokens)
+        metrics.observe("llm.rate_limit_wait_seconds", time.perf_counter() - start_time)
+
+        try:
+            async with _global_semaphore, deployment_semaphore:
+                start_time = time.perf_counter()
+                chat_completion = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=OPENAI_TIMEOUT,
+                    **kwargs,
+                )
+                metrics.observe("llm.request_seconds", time.perf_counter() - start_time)
+                metrics.incr("llm.requests")
+                return chat_completion.choices[0].message.content
+        except Exception as e:
+            if not _is_retryable(e) or attempt == OPENAI_MAX_RETRIES:
+                metrics.incr("llm.failures")
+                raise
+
+            # 指数退避加随机抖动, 如果服务端给了 Retry-After 则至少等待这么久
+            delay = random.uniform(
+                0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2**attempt)
+            )
+            retry_after = _get_retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+            metrics.incr("llm.retries")
+            logging.info(
+                f"OpenAI request failed ({type(e).__name__}), retry {attempt + 1} in {delay:.2f} seconds"
+            )
+            await asyncio.sleep(delay)
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from common import db, metrics
+
+# LLM 提取结果缓存, key 为 (规范化后的片段, prompt 版本, 模型) 的哈希
+# prompt 或解析逻辑有变化时需要修改 PROMPT_VERSION, 让旧缓存失效
+PROMPT_VERSION = "1"
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+# 每写入 N 次检查一次容量, 按最近访问时间淘汰
+EVICT_EVERY = 100
+# SQLite 单条语句的参数个数有限制, 批量查询按这个大小分段
+SQL_BATCH = 500
+
+_lock = threading.Lock()
+_conn = None
+_puts = 0
+
+# 正在请求中的 key -> asyncio.Future, 相同的片段只发起一次调用
+inflight = {}
+
+
+def _get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = db.connect("llm_cache.db")
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            _conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS llm_cache_accessed_at
+                ON llm_cache (accessed_at)
+                """
+            )
+    return _conn
+
+
+def make_key(fragment, template, model):
+    normalized = " ".join(fragment.split())
+    payload = json.dumps([normalized, PROMPT_VERSION, template, model])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _select(conn, keys):
+    rows = {}
+    for start in range(0, len(keys), SQL_BATCH):
+        chunk = keys[start : start + SQL_BATCH]
+        placeholders = ", ".join("?" * len(chunk))
+        for key, value, created_at in conn.execute(
+            f"SELECT key, value, created_at FROM llm_cache WHERE key IN ({placeholders})",
+            chunk,
+        ):
+            rows[key] = (value, created_at)
+    return rows
+
+
+def get_many(keys):
+    # 一次查询一批 key, 返回 {key: 结果}; 命中的访问时间在同一个事务里更新
+    # 会阻塞, 在事件循环中通过 asyncio.to_thread 调用
+    if not LLM_CACHE_ENABLED or not keys:
+        return {}
+
+    now = time.time()
+    conn = _get_conn()
+    with _lock:
+        rows = _select(conn, list(dict.fromkeys(keys)))
+        hits = {
+            key: json.loads(value)
+            for key, (value, created_at) in rows.items()
+            if now - created_at <= LLM_CACHE_TTL_SECONDS
+        }
+        if hits:
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "UPDATE llm_cache SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in hits],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    hit_count = sum(1 for key in keys if key in hits)
+    metrics.incr("llm_cache.hits", hit_count)
+    metrics.incr("llm_cache.misses", len(keys) - hit_count)
+    return hits
+
+
+def put_many(entries):
+    # entries 为 [(key, 结果)], 在同一个事务里写入
+    global _puts
+    if not LLM_CACHE_ENABLED or not entries:
+        return
+
+    now = time.time()
+    conn = _get_conn()
+    with _lock:
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(key, json.dumps(value), now, now) for key, value in entries],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        before = _puts
+        _puts += len(entries)
+
+    if _puts // EVICT_EVERY != before // EVICT_EVERY:
+        evict()
+
+
+def evict():
+    conn = _get_conn()
+    with _lock:
+        conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?",
+            (time.time() - LLM_CACHE_TTL_SECONDS,),
+        )
+        count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > LLM_CACHE_MAX_ENTRIES:
+            conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?
+                )
+                """,
+                (count - LLM_CACHE_MAX_ENTRIES,),
+            )
+            metrics.incr("llm_cache.evicted", count - LLM_CACHE_MAX_ENTRIES)
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+# 进程内的简单指标表: 计数器 + 耗时统计
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = {"count": 0, "total": 0.0, "max": 0.0}
+            _timings[name] = timing
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+@contextmanager
+def timer(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start_time)
+
+
+def snapshot(reset=False):
+    with _lock:
+        counters = dict(_counters)
+        timings = {name: dict(timing) for name, timing in _timings.items()}
+        if reset:
+            _counters.clear()
+            _timings.clear()
+
+    for timing in timings.values():
+        timing["avg"] = timing["total"] / timing["count"] if timing["count"] else 0.0
+    return {"counters": counters, "timings": timings}
+
+
+def merge(other):
+    # 合并来自 worker 进程的指标快照
+    with _lock:
+        for name, value in other.get("counters", {}).items():
+            _counters[name] += value
+        for name, other_timing in other.get("timings", {}).items():
+            timing = _timings.get(name)
+            if timing is None:
+                timing = {"count": 0, "total": 0.0, "max": 0.0}
+                _timings[name] = timing
+            timing["count"] += other_timing["count"]
+            timing["total"] += other_timing["total"]
+            timing["max"] = max(timing["max"], other_timing["max"])
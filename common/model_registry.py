@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import threading
+import torch
+
+from transformers import (
+    pipeline,
+    OwlViTForObjectDetection,
+    OwlViTProcessor,
+    AutoTokenizer,
+    AutoModelForSequenceClassification,
+)
+from common import metrics
+
+# 每个进程只加载一次模型, 之后常驻内存
+_lock = threading.Lock()
+_detector = None
+_classifier = None
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+OWLVIT_MODEL_PATH = os.path.join(current_dir, "owlvit-base-patch32")
+BART_MODEL_PATH = os.path.join(current_dir, "bart-large-mnli")
+CLASSIFIER_BATCH_SIZE = int(os.getenv("CLASSIFIER_BATCH_SIZE", "8"))
+
+
+def get_detector():
+    global _detector
+    if _detector is not None:
+        return _detector
+
+    with _lock:
+        if _detector is None:
+            start_time = time.perf_counter()
+            processor = OwlViTProcessor.from_pretrained(OWLVIT_MODEL_PATH)
+            model = OwlViTForObjectDetection.from_pretrained(OWLVIT_MODEL_PATH)
+            model.eval()
+            _detector = (processor, model)
+
+            load_time = time.perf_counter() - start_time
+            metrics.observe("owlvit.load_seconds", load_time)
+            logging.info(f"OWL-ViT loaded in {load_time:.2f} seconds")
+
+    return _detector
+
+
+def detect(image, labels, threshold):
+    return detect_batch([image], labels, threshold)[0]
+
+
+def detect_batch(images, labels, threshold):
+    # 多张图片(例如长页面的分段截图)在一次前向计算中完成检测, 返回每张图片的结果
+    if not images:
+        return []
+
+    # 记录本次调用中花在加载模型上的时间(已加载时接近 0)
+    start_time = time.perf_counter()
+    processor, model = get_detector()
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with torch.inference_mode():
+        inputs = processor(
+            text=[labels] * len(images), images=list(images), return_tensors="pt"
+        )
+        outputs = model(**inputs)
+        # 图片尺寸为 (width, height), post_process 需要 (height, width)
+        target_sizes = torch.tensor([image.size[::-1] for image in images])
+        detections = processor.image_processor.post_process_object_detection(
+            outputs=outputs, threshold=threshold, target_sizes=target_sizes
+        )
+    inference_time = time.perf_counter() - start_time
+
+    batch_results = []
+    for detection in detections:
+        results = [
+            {
+                "score": score.item(),
+                "label": labels[label],
+                "box": {
+                    "xmin": int(box[0]),
+                    "ymin": int(box[1]),
+                    "xmax": int(box[2]),
+                    "ymax": int(box[3]),
+                },
+            }
+            for score, label, box in zip(
+                detection["scores"], detection["labels"].tolist(), detection["boxes"]
+            )
+        ]
+        # 与 pipeline 的输出保持一致, 按分数从高到低排序
+        results.sort(key=lambda result: result["score"], reverse=True)
+        batch_results.append(results)
+
+    metrics.observe("owlvit.inference_seconds", inference_time)
+    logging.info(
+        f"OWL-ViT detect: load {load_time:.2f}s, inference {inference_time:.2f}s, "
+        f"{len(images)} images, {sum(len(r) for r in batch_results)} boxes"
+    )
+    return batch_results
+
+
+def get_classifier():
+    global _classifier
+    if _classifier is not None:
+        return _classifier
+
+    with _lock:
+        if _classifier is None:
+            start_time = time.perf_counter()
+            tokenizer = AutoTokenizer.from_pretrained(BART_MODEL_PATH)
+            model = AutoModelForSequenceClassification.from_pretrained(BART_MODEL_PATH)
+            model.eval()
+            _classifier = pipeline(
+                "zero-shot-classification", model=model, tokenizer=tokenizer
+            )
+
+            load_time = time.perf_counter() - start_time
+            metrics.observe("bart.load_seconds", load_time)
+            logging.info(f"BART-MNLI loaded in {load_time:.2f} seconds")
+
+    return _classifier
+
+
+def classify(texts, candidate_labels, batch_size=None):
+    # 返回每段文本对应的 {label: score}
+    if not texts:
+        return []
+
+    classifier = get_classifier()
+
+    start_time = time.perf_counter()
+    with torch.inference_mode():
+        results = classifier(
+            list(texts),
+            candidate_labels,
+            batch_size=batch_size or CLASSIFIER_BATCH_SIZE,
+        )
+    inference_time = time.perf_counter() - start_time
+
+    # 单条输入时 pipeline 返回的是 dict 而不是 list
+    if isinstance(results, dict):
+        results = [results]
+
+    metrics.observe("bart.inference_seconds", inference_time)
+    logging.info(
+        f"BART-MNLI classify: {len(texts)} texts, inference {inference_time:.2f}s"
+    )
+    return [dict(zip(result["labels"], result["scores"])) for result in results]
@@ -0,0 +1,119 @@
+import os
+import re
+import tiktoken
+
+from bs4 import BeautifulSoup, Comment
+
+# 每个列表项送入 LLM 之前的 token 上限
+LLM_ITEM_TOKEN_BUDGET = int(os.getenv("LLM_ITEM_TOKEN_BUDGET", "1500"))
+
+REMOVED_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "svg",
+    "template",
+    "iframe",
+    "link",
+    "meta",
+    "canvas",
+    "video",
+    "audio",
+]
+KEPT_ATTRIBUTES = {"href", "src", "srcset", "alt", "title", "itemprop", "content"}
+# 价格/型号/品牌等 data-* 属性, 以及懒加载图片常用的属性
+KEPT_DATA_ATTRIBUTE = re.compile(
+    r"^data-(.*(price|currency|sku|brand|ref|model|name|product)|(lazy-)?src(set)?|original)",
+    re.IGNORECASE,
+)
+UNWRAPPED_TAGS = {"div", "span", "section", "article", "font", "b", "i", "strong", "em"}
+# 块级标签之间的空白不影响文本, 行内标签之间的空格是内容的一部分
+BLOCK_TAGS = set(
+    """
+    address article aside blockquote body dd details dialog div dl dt fieldset
+    figcaption figure footer form h1 h2 h3 h4 h5 h6 header hr html li main nav
+    ol p pre section summary table tbody td tfoot th thead tr ul
+    """.split()
+)
+_TAG_GAP = re.compile(r"(</?([a-zA-Z][\w-]*)[^>]*>) (?=</?([a-zA-Z][\w-]*))")
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.encoding_for_model("gpt-4")
+    return _encoding
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, budget=LLM_ITEM_TOKEN_BUDGET):
+    tokens = get_encoding().encode(text, disallowed_special=())
+    if len(tokens) <= budget:
+        return text
+    return get_encoding().decode(tokens[:budget])
+
+
+def _clean_attributes(element):
+    attributes = {}
+    for name, value in element.attrs.items():
+        if name not in KEPT_ATTRIBUTES and not KEPT_DATA_ATTRIBUTE.match(name):
+            continue
+        if isinstance(value, list):
+            value = " ".join(value)
+        value = value.strip()
+        if not value or value.startswith("data:"):
+            continue
+        if name.endswith("srcset"):
+            # srcset 只保留最后(通常是最大)的一张图片
+            value = value.split(",")[-1].strip().split(" ")[0]
+        attributes[name] = value
+    element.attrs = attributes
+
+
+def minify_html(html):
+    soup = BeautifulSoup(html, "lxml")
+
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for element in soup.find_all(REMOVED_TAGS):
+        element.decompose()
+
+    for element in soup.find_all(True):
+        _clean_attributes(element)
+
+    # 没有任何属性的包装标签直接展开, 只保留内容
+    for element in soup.find_all(list(UNWRAPPED_TAGS)):
+        if not element.attrs:
+            element.unwrap()
+
+    root = soup.body or soup
+    html = "".join(str(child) for child in root.contents)
+    html = re.sub(r"\s+", " ", html)
+    html = _TAG_GAP.sub(_collapse_tag_gap, html)
+    return html.strip()
+
+
+def _collapse_tag_gap(match):
+    if match.group(2).lower() in BLOCK_TAGS or match.group(3).lower() in BLOCK_TAGS:
+        return match.group(1)
+    return match.group(0)
+
+
+def prepare_items(items, kind, budget=LLM_ITEM_TOKEN_BUDGET):
+    # 返回处理后的列表项, 以及处理前后的 token 数
+    tokens_before = 0
+    tokens_after = 0
+    prepared = []
+    for item in items:
+        tokens_before += count_tokens(item)
+        if kind == "HTML":
+            item = minify_html(item)
+        item = truncate_to_tokens(item, budget)
+        tokens_after += count_tokens(item)
+        prepared.append(item)
+    return prepared, tokens_before, tokens_after
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+
+from urllib.parse import urlparse
+from common import metrics
+
+# 页面就绪判断: 网络空闲 -> DOM 静止 -> 可见图片加载完成, 每个阶段有独立的超时
+READY_POLL_INTERVAL = float(os.getenv("READY_POLL_INTERVAL", "0.1"))
+READY_NETWORK_TIMEOUT = float(os.getenv("READY_NETWORK_TIMEOUT", "15"))
+READY_NETWORK_QUIET_MS = int(os.getenv("READY_NETWORK_QUIET_MS", "500"))
+# 允许保留的在途请求数量(长轮询/统计上报等永远不会结束的请求)
+READY_NETWORK_MAX_INFLIGHT = int(os.getenv("READY_NETWORK_MAX_INFLIGHT", "0"))
+# 超过该时长仍未结束的请求不再计入, 避免一直等不到响应导致计数泄漏
+READY_STALE_REQUEST_SECONDS = float(os.getenv("READY_STALE_REQUEST_SECONDS", "10"))
+READY_DOM_TIMEOUT = float(os.getenv("READY_DOM_TIMEOUT", "10"))
+READY_DOM_QUIET_MS = int(os.getenv("READY_DOM_QUIET_MS", "500"))
+READY_IMAGES_TIMEOUT = float(os.getenv("READY_IMAGES_TIMEOUT", "10"))
+
+STAGES = ("network", "dom", "images")
+
+dom_quiet_script = """
+    // 首次调用时安装 MutationObserver, 返回距离最后一次 DOM 变化的毫秒数
+    if (window.__crawlerLastMutation === undefined) {
+        window.__crawlerLastMutation = performance.now();
+        new MutationObserver(function () {
+            window.__crawlerLastMutation = performance.now();
+        }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    }
+    return performance.now() - window.__crawlerLastMutation;
+    """
+
+images_ready_script = """
+    // 只等待容器内或视口内的图片, 懒加载且不在视口内的图片永远不会加载
+    var container = arguments[0];
+    var images = Array.from((container || document).querySelectorAll('img'));
+    if (!container) {
+        var height = window.innerHeight, width = window.innerWidth;
+        images = images.filter(function (img) {
+            var rect = img.getBoundingClientRect();
+            return rect.width > 0 && rect.bottom > 0 && rect.top < height && rect.right > 0 && rect.left < width;
+        });
+    }
+    return images.every(function (img) { return img.complete; });
+    """
+
+
+def drain_network_events(driver):
+    # performance 日志会一直累积, 每次读取都会清空
+    try:
+        entries = driver.get_log("performance")
+    except Exception as e:
+        logging.info(f"Error reading performance log: {e}")
+        return []
+    record_visited_origins(driver, entries)
+    return entries
+
+
+def record_visited_origins(driver, entries):
+    # 记录页面/iframe 及其重定向访问过的源, 归还浏览器时逐个清理这些源的存储
+    origins = getattr(driver, "visited_origins", None)
+    if origins is None:
+        return
+    for entry in entries:
+        if '"Document"' not in entry.get("message", ""):
+            continue
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        params = message.get("params", {})
+        if (
+            message.get("method") != "Network.requestWillBeSent"
+            or params.get("type") != "Document"
+        ):
+            continue
+        parsed = urlparse(params.get("request", {}).get("url", ""))
+        if parsed.scheme in ("http", "https"):
+            origins.add(f"{parsed.scheme}://{parsed.netloc}")
+
+
+def wait_for_network_idle(
+    driver,
+    timeout=READY_NETWORK_TIMEOUT,
+    quiet_ms=READY_NETWORK_QUIET_MS,
+    max_inflight=READY_NETWORK_MAX_INFLIGHT,
+):
+    # 通过 CDP Network 事件跟踪所有在途请求, 不依赖请求头
+    inflight = {}
+    deadline = time.monotonic() + timeout
+    quiet_since = None
+
+    while True:
+        now = time.monotonic()
+        for entry in drain_network_events(driver):
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, ValueError):
+                continue
+            method = message.get("method")
+            request_id = message.get("params", {}).get("requestId")
+            if method == "Network.requestWillBeSent":
+                url = message["params"].get("request", {}).get("url", "")
+                if not url.startswith("data:"):
+                    inflight[request_id] = now
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                inflight.pop(request_id, None)
+                profile = getattr(driver, "blocking_profile", None)
+                if method == "Network.loadingFinished":
+                    # 浏览器实际下载的字节数, 与 selenium-wire 的捕获范围无关, 用于比较拦截 profile
+                    metrics.incr(
+                        f"blocking.{profile}.transferred_bytes",
+                        message["params"].get("encodedDataLength", 0),
+                    )
+                elif message["params"].get("blockedReason") == "inspector":
+                    # 被 Network.setBlockedURLs 拦截的请求
+                    metrics.incr(f"blocking.{profile}.blocked_requests")
+                    metrics.incr(f"blocking.{profile}.blocked.browser")
+
+        for request_id, started in list(inflight.items()):
+            if now - started > READY_STALE_REQUEST_SECONDS:
+                del inflight[request_id]
+
+        if len(inflight) <= max_inflight:
+            if quiet_since is None:
+                quiet_since = now
+            if (now - quiet_since) * 1000 >= quiet_ms:
+                return True
+        else:
+            quiet_since = None
+
+        if now >= deadline:
+            logging.info(f"Timeout waiting for network idle, {len(inflight)} in flight")
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+
+
+def wait_for_dom_quiet(driver, timeout=READY_DOM_TIMEOUT, quiet_ms=READY_DOM_QUIET_MS):
+    deadline = time.monotonic() + timeout
+    while True:
+        quiet_for = driver.execute_script(dom_quiet_script)
+        if quiet_for >= quiet_ms:
+            return True
+        if time.monotonic() >= deadline:
+            logging.info("Timeout waiting for DOM to settle")
+            return False
+        # 剩余的静止时间内 DOM 不可能满足条件, 直接等待差值
+        time.sleep(max(READY_POLL_INTERVAL, (quiet_ms - quiet_for) / 1000))
+
+
+def wait_for_visible_images(driver, container=None, timeout=READY_IMAGES_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        if driver.execute_script(images_ready_script, container):
+            return True
+        if time.monotonic() >= deadline:
+            logging.info("Timeout waiting for visible images to load")
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+
+
+def wait_until_ready(driver, stages=STAGES, container=None, timeouts=None):
+    # 依次执行各个阶段, 记录每个阶段的耗时, 超时后继续执行后面的阶段
+    # timeouts 可以按阶段覆盖默认超时, 例如 {"images": 2}
+    timeouts = timeouts or {}
+    durations = {}
+    for stage in stages:
+        start_time = time.perf_counter()
+        if stage == "network":
+            ready = wait_for_network_idle(
+                driver, timeout=timeouts.get("network", READY_NETWORK_TIMEOUT)
+            )
+        elif stage == "dom":
+            ready = wait_for_dom_quiet(
+                driver, timeout=timeouts.get("dom", READY_DOM_TIMEOUT)
+            )
+        elif stage == "images":
+            ready = wait_for_visible_images(
+                driver, container, timeout=timeouts.get("images", READY_IMAGES_TIMEOUT)
+            )
+        else:
+            raise ValueError(f"Unknown readiness stage: {stage}")
+
+        durations[stage] = time.perf_counter() - start_time
+        metrics.observe(f"ready.{stage}_seconds", durations[stage])
+        if not ready:
+            metrics.incr(f"ready.{stage}_timeouts")
+
+    logging.info(
+        "Page ready: "
+        + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in durations.items())
+    )
+    return durations
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+from urllib.parse import urlparse
+from common import archive, utils, worker_pool, extraction, metrics
+
+# 对已归档的快照重新执行列表识别和提取, 修改 prompt 或解析规则后不需要重新抓取页面
+REPROCESS_CONCURRENCY = int(os.getenv("REPROCESS_CONCURRENCY", "8"))
+# 接口只允许读取这个目录下的本地快照
+REPROCESS_ROOT = os.getenv("REPROCESS_ROOT", "snapshots")
+
+
+def resolve_directory(directory, root=REPROCESS_ROOT):
+    # 相对路径按 root 解析, 不允许跳出 root
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Directory {directory} is outside {root}")
+    return path
+
+
+def list_directory(directory):
+    return sorted(
+        os.path.join(directory, file_name)
+        for file_name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, file_name))
+    )
+
+
+def read_file(path):
+    # 根据扩展名解压, 返回 (快照名称, 原始内容, Content-Type)
+    with open(path, "rb") as f:
+        body = f.read()
+
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        body, name = archive.decompress(body, "gzip"), name[:-3]
+    elif name.endswith(".zst"):
+        body, name = archive.decompress(body, "zstd"), name[:-4]
+
+    content_type = "text/html"
+    if name.endswith(".json"):
+        content_type = "application/json"
+    name = os.path.splitext(name)[0]
+    return name, body, content_type
+
+
+def s3_sources(names):
+    # [(快照名称, 加载函数)]
+    def loader(name):
+        async def load():
+            body, content_type = await archive.get(name)
+            return name, body, content_type
+
+        return load
+
+    return [(name, loader(name)) for name in names]
+
+
+def directory_sources(directory):
+    def loader(path):
+        async def load():
+            return await asyncio.to_thread(read_file, path)
+
+        return load
+
+    return [(os.path.basename(path), loader(path)) for path in list_directory(directory)]
+
+
+async def process_snapshot(
+    name, body, content_type, domain=None, detail_url_template=None
+):
+    if domain is None:
+        url = archive.snapshot_url(name)
+        domain = urlparse(url).netloc if url else None
+
+    # 列表识别在常驻 worker 进程中执行, 多个快照可以同时占满所有 CPU
+    if "json" in content_type:
+        kind = "JSON"
+        array, _ = await worker_pool.run(utils.find_most_related_array, json.loads(body))
+        items = [json.dumps(item) for item in array or []]
+        parent = None
+    else:
+        kind = "HTML"
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        result = await worker_pool.run(utils.get_api_html_list, body)
+        items, parent = result or ([], "")
+
+    conditions = extraction.build_conditions(
+        domain, detail_url_template=detail_url_template
+    )
+    listings = await extraction.extract_listings(
+        items, kind, conditions, domain=domain
+    )
+    return {
+        "s3_uuid": name,
+        "kind": kind,
+        "domain": domain,
+        "items": len(items),
+        "listings": listings,
+        "parent": parent,
+    }
+
+
+async def run(sources, concurrency=None, domain=None, detail_url_template=None):
+    # 按完成顺序逐个返回结果, 每个结果带上当前进度
+    semaphore = asyncio.Semaphore(concurrency or REPROCESS_CONCURRENCY)
+    total = len(sources)
+
+    async def process(name, load):
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                name, body, content_type = await load()
+                result = await process_snapshot(
+                    name, body, content_type, domain, detail_url_template
+                )
+                metrics.incr("reprocess.succeeded")
+            except Exception as e:
+                logging.info(f"Error reprocessing {name}: {e}")
+                metrics.incr("reprocess.failed")
+                result = {"s3_uuid": name, "error": str(e)}
+            metrics.observe("reprocess.snapshot_seconds", time.perf_counter() - start_time)
+            return result
+
+    tasks = [asyncio.create_task(process(name, load)) for name, load in sources]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            result = await task
+            result["progress"] = {"done": done, "total": total}
+            logging.info(f"Reprocessed {done}/{total}: {result['s3_uuid']}")
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
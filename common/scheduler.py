@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+
+from contextlib import asynccontextmanager
+from common import metrics
+
+# 批量抓取的全局调度: 总并发上限 + 每个站点的并发上限和请求间隔
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "32"))
+CRAWL_MAX_PER_DOMAIN = int(os.getenv("CRAWL_MAX_PER_DOMAIN", "2"))
+CRAWL_MIN_DELAY_SECONDS = float(os.getenv("CRAWL_MIN_DELAY_SECONDS", "1"))
+
+_global_semaphore = None
+_domains = {}
+_in_flight = 0
+
+
+def _get_global_semaphore():
+    global _global_semaphore
+    if _global_semaphore is None:
+        _global_semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    return _global_semaphore
+
+
+def _get_domain(domain):
+    if domain not in _domains:
+        _domains[domain] = {
+            "semaphore": asyncio.Semaphore(CRAWL_MAX_PER_DOMAIN),
+            "lock": asyncio.Lock(),
+            "last_start": 0.0,
+            "waiting": 0,
+        }
+    return _domains[domain]
+
+
+@asynccontextmanager
+async def slot(domain):
+    # 先排站点的队, 再占用全局名额, 等待中的站点不会占住其他站点的名额
+    global _in_flight
+    state = _get_domain(domain)
+    start_time = time.perf_counter()
+    state["waiting"] += 1
+    try:
+        await state["semaphore"].acquire()
+        try:
+            async with state["lock"]:
+                wait = state["last_start"] + CRAWL_MIN_DELAY_SECONDS - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await _get_global_semaphore().acquire()
+                state["last_start"] = time.monotonic()
+        except BaseException:
+            state["semaphore"].release()
+            raise
+    finally:
+        state["waiting"] -= 1
+    metrics.observe("crawl.wait_seconds", time.perf_counter() - start_time)
+
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        _global_semaphore.release()
+        state["semaphore"].release()
+
+
+def stats():
+    return {
+        "concurrency": CRAWL_CONCURRENCY,
+        "in_flight": _in_flight,
+        "waiting": {
+            domain: state["waiting"]
+            for domain, state in _domains.items()
+            if state["waiting"]
+        },
+    }
@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse
+from common import db, metrics
+
+# 每个域名学习一次字段选择器, 之后的抓取直接用选择器提取, 不再调用 LLM
+TEMPLATE_SAMPLE_SIZE = int(os.getenv("TEMPLATE_SAMPLE_SIZE", "5"))
+TEMPLATE_MIN_MATCH_RATIO = float(os.getenv("TEMPLATE_MIN_MATCH_RATIO", "0.8"))
+TEMPLATE_MAX_FAILURE_RATIO = float(os.getenv("TEMPLATE_MAX_FAILURE_RATIO", "0.3"))
+TEMPLATE_MAX_AGE_DAYS = float(os.getenv("TEMPLATE_MAX_AGE_DAYS", "7"))
+
+TEMPLATE_FIELDS = ["name", "price", "image", "url", "brand", "reference"]
+URL_FIELDS = {"image", "url"}
+IMAGE_ATTRIBUTES = [
+    "src",
+    "data-src",
+    "data-original",
+    "data-lazy-src",
+    "srcset",
+    "data-srcset",
+]
+CSS_CLASS = re.compile(r"^-?[A-Za-z_][\w-]*$")
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = db.connect("templates.db")
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS templates (
+                    domain TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    template TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (domain, kind)
+                )
+                """
+            )
+    return _conn
+
+
+def load(domain, kind):
+    row = _get_conn().execute(
+        "SELECT template, created_at FROM templates WHERE domain = ? AND kind = ?",
+        (domain, kind),
+    ).fetchone()
+    if row is None:
+        return None
+
+    template, created_at = row
+    if time.time() - created_at > TEMPLATE_MAX_AGE_DAYS * 86400:
+        logging.info(f"Template for {domain} ({kind}) is stale")
+        invalidate(domain, kind)
+        return None
+    return json.loads(template)
+
+
+def save(domain, kind, template):
+    _get_conn().execute(
+        "INSERT OR REPLACE INTO templates (domain, kind, template, created_at) VALUES (?, ?, ?, ?)",
+        (domain, kind, json.dumps(template), time.time()),
+    )
+
+
+def invalidate(domain, kind):
+    metrics.incr("templates.invalidated")
+    _get_conn().execute(
+        "DELETE FROM templates WHERE domain = ? AND kind = ?", (domain, kind)
+    )
+
+
+def _normalize(value):
+    return " ".join(str(value).split()).lower()
+
+
+def _digits(value):
+    return re.sub(r"\D", "", str(value))
+
+
+def _url_key(base, value):
+    parsed = urlparse(urljoin(base, str(value).strip()))
+    return parsed.path.rstrip("/") + ("?" + parsed.query if parsed.query else "")
+
+
+def _matches(field, base, extracted, expected):
+    if extracted is None or expected in (None, ""):
+        return False
+    if field == "price":
+        return _digits(extracted) != "" and _digits(extracted) == _digits(expected)
+    if field in URL_FIELDS:
+        key = _url_key(base, extracted)
+        return key not in ("", "/") and key == _url_key(base, expected)
+    return _normalize(extracted) != "" and _normalize(extracted) == _normalize(
+        expected
+    )
+
+
+def is_valid_listing(listing):
+    return bool(listing.get("name")) and bool(
+        listing.get("price") or listing.get("url")
+    )
+
+
+# ---------- HTML 模板: 字段 -> 相对列表项根节点的 CSS 选择器 ----------
+
+
+def _parse_html_item(html):
+    soup = BeautifulSoup(html, "lxml")
+    root = soup.body or soup
+    return root.find(True)
+
+
+def _html_value(root, rule):
+    if rule["selector"] == "":
+        element = root
+    else:
+        element = root.select_one(f":scope > {rule['selector']}")
+    if element is None:
+        return None
+    if rule["attr"] is None:
+        return element.get_text(" ", strip=True) or None
+
+    value = element.get(rule["attr"])
+    if value and rule["attr"].endswith("srcset"):
+        value = value.split(",")[-1].strip().split(" ")[0]
+    return value or None
+
+
+def _html_selectors(root, element):
+    # 完整的 tag.class 路径, 以及只保留末级 class 的宽松路径
+    steps = []
+    while element is not root:
+        classes = [c for c in element.get("class", []) if CSS_CLASS.match(c)]
+        steps.append((element.name, classes))
+        element = element.parent
+    steps.reverse()
+    if not steps:
+        return [""]
+
+    def step(name, classes):
+        return name + "".join(f".{c}" for c in classes)
+
+    full = " > ".join(step(name, classes) for name, classes in steps)
+    loose = " > ".join([name for name, _ in steps[:-1]] + [step(*steps[-1])])
+    return list(dict.fromkeys([full, loose]))
+
+
+def _html_candidates(root, field, base, expected):
+    candidates = []
+    elements = [root] + root.find_all(True)
+    if field == "image":
+        for element in elements:
+            for attr in IMAGE_ATTRIBUTES:
+                if element.get(attr):
+                    for selector in _html_selectors(root, element):
+                        rule = {"selector": selector, "attr": attr}
+                        if _matches(field, base, _html_value(root, rule), expected):
+                            candidates.append(rule)
+    elif field == "url":
+        for element in elements:
+            if element.get("href"):
+                for selector in _html_selectors(root, element):
+                    rule = {"selector": selector, "attr": "href"}
+                    if _matches(field, base, _html_value(root, rule), expected):
+                        candidates.append(rule)
+    else:
+        for element in elements:
+            text = element.get_text(" ", strip=True)
+            if len(text) > 200 or not _matches(field, base, text, expected):
+                continue
+            for selector in _html_selectors(root, element):
+                candidates.append({"selector": selector, "attr": None})
+        # 最深的节点最精确, 优先尝试
+        candidates.reverse()
+    return candidates
+
+
+# ---------- JSON 模板: 字段 -> 列表项中的 key 路径 ----------
+
+
+def _json_leaves(data, path=(), depth=0):
+    if depth > 6:
+        return
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from _json_leaves(value, path + (key,), depth + 1)
+    elif isinstance(data, list):
+        for index, value in enumerate(data[:5]):
+            yield from _json_leaves(value, path + (index,), depth + 1)
+    elif data is not None and not isinstance(data, bool):
+        yield list(path), data
+
+
+def _json_value(item, rule):
+    data = item
+    for key in rule["path"]:
+        if not isinstance(data, (dict, list)):
+            return None
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    if data is None or isinstance(data, (dict, list)):
+        return None
+    return data
+
+
+def _json_candidates(item, field, base, expected):
+    return [
+        {"path": path}
+        for path, value in _json_leaves(item)
+        if _matches(field, base, value, expected)
+    ]
+
+
+def _parse_item(item, kind):
+    try:
+        return json.loads(item) if kind == "JSON" else _parse_html_item(item)
+    except (ValueError, TypeError):
+        return None
+
+
+def _value(parsed, rule, kind):
+    if parsed is None:
+        return None
+    return _json_value(parsed, rule) if kind == "JSON" else _html_value(parsed, rule)
+
+
+def learn(domain, kind, samples):
+    # samples: [(原始列表项, LLM 提取的结果)], 为每个字段找出在大多数样本上都能复现结果的规则
+    base = f"https://{domain}/"
+    samples = [
+        (_parse_item(item, kind), listing)
+        for item, listing in samples[:TEMPLATE_SAMPLE_SIZE]
+        if isinstance(listing, dict)
+    ]
+    samples = [(parsed, listing) for parsed, listing in samples if parsed is not None]
+    if not samples:
+        return None
+
+    fields = {}
+    for field in TEMPLATE_FIELDS:
+        expected_samples = [
+            (parsed, listing[field])
+            for parsed, listing in samples
+            if listing.get(field) not in (None, "")
+        ]
+        if not expected_samples:
+            continue
+
+        candidates = []
+        for parsed, expected in expected_samples:
+            candidates.extend(
+                _json_candidates(parsed, field, base, expected)
+                if kind == "JSON"
+                else _html_candidates(parsed, field, base, expected)
+            )
+
+        required = math.ceil(len(expected_samples) * TEMPLATE_MIN_MATCH_RATIO)
+        seen = set()
+        for rule in candidates:
+            key = json.dumps(rule)
+            if key in seen:
+                continue
+            seen.add(key)
+            matched = sum(
+                _matches(field, base, _value(parsed, rule, kind), expected)
+                for parsed, expected in expected_samples
+            )
+            if matched >= required:
+                fields[field] = rule
+                break
+
+    template = {"fields": fields}
+    if not is_valid_listing({field: True for field in fields}):
+        logging.info(f"Can not learn a template for {domain} ({kind}): {list(fields)}")
+        return None
+
+    save(domain, kind, template)
+    metrics.incr("templates.learned")
+    logging.info(f"Learned template for {domain} ({kind}): {list(fields)}")
+    return template
+
+
+def apply(template, domain, kind, item):
+    base = f"https://{domain}/"
+    parsed = _parse_item(item, kind)
+    listing = {}
+    for field, rule in template["fields"].items():
+        value = _value(parsed, rule, kind)
+        if value is not None and field in URL_FIELDS:
+            value = urljoin(base, str(value).strip())
+        elif value is not None:
+            value = str(value).strip()
+        listing[field] = value
+    return listing
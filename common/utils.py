@@ -1,7 +1,6 @@
 import os
+import io
 import time
-import aioboto3
-import uuid
 import gc
 import glob
 import shutil
@@ -10,27 +9,49 @@ import logging
 import torch
 
 from bs4 import BeautifulSoup
+from PIL import Image
 from tempfile import mkdtemp
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service as ChromeService
 from seleniumwire import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
-from collections import Counter
-from openai import AsyncAzureOpenAI
-from transformers import (
-    pipeline,
-    OwlViTForObjectDetection,
-    OwlViTProcessor,
-    AutoImageProcessor,
-    AutoTokenizer,
-    AutoModelForSequenceClassification,
-)
-from collections import defaultdict
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from bisect import bisect_right
+from collections import Counter, defaultdict
 from torchvision.ops import box_iou
 from fake_useragent import UserAgent
+from common import model_registry, llm, metrics, blocking, capture, archive, readiness
+
+# 页面高度超过该值时按视口分段截图检测, 避免整页截图被模型缩小后丢失小目标
+TILED_DETECTION_MIN_HEIGHT = int(os.getenv("TILED_DETECTION_MIN_HEIGHT", "4000"))
+# 相邻分段之间的重叠高度, 保证跨边界的商品至少在一个分段中是完整的
+DETECTION_TILE_OVERLAP = int(os.getenv("DETECTION_TILE_OVERLAP", "200"))
+DETECTION_TILE_BATCH_SIZE = int(os.getenv("DETECTION_TILE_BATCH_SIZE", "4"))
+DETECTION_MAX_TILES = int(os.getenv("DETECTION_MAX_TILES", "40"))
+# 每次滚动后等待视口内图片加载的最长时间, 懒加载/虚拟列表在滚动后才会渲染
+DETECTION_TILE_READY_TIMEOUT = float(os.getenv("DETECTION_TILE_READY_TIMEOUT", "2"))
+# 先根据 DOM 结构和布局查找商品列表, 置信度足够时跳过截图和视觉检测
+DOM_FAST_PATH = os.getenv("DOM_FAST_PATH", "1") == "1"
+DOM_FAST_PATH_MIN_ITEMS = int(os.getenv("DOM_FAST_PATH_MIN_ITEMS", "4"))
+DOM_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("DOM_FAST_PATH_MIN_CONFIDENCE", "0.6"))
+
+# chromedriver 路径和 UserAgent 数据在每个进程中只解析一次
+_driver_path = None
+_user_agent = None
+
+
+def resolve_driver_path():
+    global _driver_path
+    if _driver_path is None:
+        _driver_path = ChromeDriverManager().install()
+        logging.info(f"Resolved chromedriver: {_driver_path}")
+    return _driver_path
+
+
+def get_user_agent():
+    global _user_agent
+    if _user_agent is None:
+        _user_agent = UserAgent()
+    return _user_agent.random
 
 
 def get_driver():
@@ -54,10 +75,12 @@ def get_driver():
     options.add_argument(f"--data-path={data_path}")
     options.add_argument(f"--disk-cache-dir={disk_cache_dir}")
     options.add_argument(f"--homedir={homedir}")
-    agent = UserAgent().random
+    agent = get_user_agent()
     logging.info(f"user-agent={agent}")
     options.add_argument(f"--user-agent={agent}")
     # options.set_capability("goog:loggingPrefs", {"browser": "ALL"})
+    # 通过 performance 日志读取 CDP Network 事件, 用于判断网络是否空闲
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
 
     # PROXY_USERNAME = os.getenv("PROXY_USERNAME", None)
     # PROXY_PASS = os.getenv("PROXY_PASS", None)
@@ -71,18 +94,20 @@ def get_driver():
     # proxies_extension = proxies(PROXY_USERNAME, PROXY_PASS, PROXY_ENDPOINT, PROXY_PORT)
     # options.add_extension(proxies_extension)
 
-    seleniumwire_options = {}
+    # 限制 selenium-wire 保存的请求数量
+    seleniumwire_options = capture.seleniumwire_options()
     # use proxy if PROXY_URL
     PROXY_URL = os.getenv("PROXY", None)
     if PROXY_URL:
-        seleniumwire_options = {
-            "proxy": {"http": f"{PROXY_URL}", "https": f"{PROXY_URL}"},
+        seleniumwire_options["proxy"] = {
+            "http": f"{PROXY_URL}",
+            "https": f"{PROXY_URL}",
         }
         logging.info(f"use proxy {PROXY_URL}")
     else:
         logging.info("no proxy")
 
-    service = ChromeService(ChromeDriverManager().install())
+    service = ChromeService(resolve_driver_path())
     try:
         # 添加延迟确保 Chrome 完全启动
 
@@ -91,7 +116,10 @@ def get_driver():
             seleniumwire_options=seleniumwire_options,
             options=options,
         )
-        driver.pending_requests_count = 0
+        driver.blocking_profile = blocking.BLOCKING_PROFILE
+        # 由 readiness 读取网络事件时记录, 归还浏览器时清理这些源的存储
+        driver.visited_origins = set()
+        capture.limit_storage(driver)
         driver.request_interceptor = lambda request: request_interceptor(
             request, driver
         )
@@ -154,100 +182,100 @@ def check_space(title):
     )
 
 
-# 启用CDP监听
-def enable_request_logging(driver):
-    driver.execute_cdp_cmd("Network.enable", {})
-
-
-def is_ajax_request(request):
-    return (
-        request.headers.get("X-Requested-With") == "XMLHttpRequest"
-        or request.headers.get("Content-Type")
-        and "application/json" in request.headers.get("Content-Type")
-    )
-
-
 def request_interceptor(request, driver):
-    if is_ajax_request(request):
-        # 使用 driver 实例的 pending_requests_count 属性
-        driver.pending_requests_count += 1
+    # 按当前任务的 profile 拦截字体/音视频/统计广告等请求
+    blocking.intercept(request, driver.blocking_profile)
 
 
 def response_interceptor(request, response, driver):
-    if is_ajax_request(request):
-        # 使用 driver 实例的 pending_requests_count 属性
-        driver.pending_requests_count -= 1
-
+    blocking.record_response(request, response, driver.blocking_profile)
 
-def wait_for_requests_to_complete(driver, timeout=30):
-    try:
-        start_time = time.time()
 
-        WebDriverWait(driver, timeout).until(lambda d: d.pending_requests_count == 0)
+def watch_detect(image, threshold=0.001):
+    results = model_registry.detect(image, ["watch"], threshold)
 
-        total_time = time.time() - start_time
-        logging.info(f"Waited for XHR requests to complete: {total_time:.2f} seconds")
-    except TimeoutException:
-        logging.info("Timeout waiting for requests, but continuing execution.")
+    boxes = [result["box"] for result in results]
+    scores = [result["score"] for result in results]
 
+    keep = overlapping_boxes_keep(boxes, scores, iou_threshold=0.005)
 
-# 使用 WebDriverWait 等待图片完全加载
-def wait_for_images_to_load(driver, timeout=30):
-    try:
-        WebDriverWait(driver, timeout).until(
-            lambda d: d.execute_script(
-                """
-                let images = Array.from(document.images);
-                return images.every(img => img.complete && img.naturalWidth > 0);
-                """
-            )
-        )
-        logging.info("Images loaded successfully.")
-    except TimeoutException:
-        logging.info("Timeout waiting for images to load, but continuing execution.")
+    return [results[i] for i in keep]
 
 
-def watch_detect(image, threshold=0.001):
-    current_file_path = os.path.abspath(__file__)
-    current_dir = os.path.dirname(current_file_path)
-    model_path = os.path.join(current_dir, "owlvit-base-patch32")
-
-    # 加载模型和处理器
-    processor = OwlViTProcessor.from_pretrained(model_path)
-    image_processor = AutoImageProcessor.from_pretrained(model_path)
-    model = OwlViTForObjectDetection.from_pretrained(model_path)
-
-    # 使用本地模型初始化 pipeline
-    detector = pipeline(
-        "zero-shot-object-detection",
-        model=model,
-        image_processor=image_processor,  # 显式指定图像处理器
-        tokenizer=processor.tokenizer,  # 显式指定文本处理器
-    )
-
-    results = detector(image, candidate_labels=["watch"], threshold=threshold)
+def iter_page_tiles(driver, page_height, overlap=DETECTION_TILE_OVERLAP):
+    # 通过滚动而不是放大窗口来截取整页, 每次只持有一个视口大小的截图
+    viewport_height = driver.execute_script("return window.innerHeight;")
+    step = max(viewport_height - overlap, 1)
+    offset = 0
+    for _ in range(DETECTION_MAX_TILES):
+        scroll_y = driver.execute_script(
+            "window.scrollTo({top: arguments[0], left: 0, behavior: 'instant'});"
+            "return window.scrollY;",
+            offset,
+        )
+        readiness.wait_until_ready(
+            driver, stages=("images",), timeouts={"images": DETECTION_TILE_READY_TIMEOUT}
+        )
+        screenshot = driver.get_screenshot_as_png()
+        yield Image.open(io.BytesIO(screenshot)), scroll_y
+        del screenshot
 
-    boxes = [result["box"] for result in results]
-    scores = [result["score"] for result in results]
+        if scroll_y + viewport_height >= page_height or scroll_y < offset:
+            break
+        offset = scroll_y + step
+    else:
+        # 达到分段上限, 页面剩余部分不会被检测
+        metrics.incr("detection.tiles_truncated")
+        logging.warning(
+            f"Tiled detection stopped after {DETECTION_MAX_TILES} tiles on "
+            f"{driver.current_url}: covered {scroll_y + viewport_height}px "
+            f"of {page_height}px"
+        )
 
-    filtered_boxes = filter_overlapping_boxes(boxes, scores, iou_threshold=0.005)
 
-    filtered_results = []
-    for box in filtered_boxes:
-        for result in results:
-            if result["box"] == box:
-                filtered_results.append(result)
-                break
+def watch_detect_tiled(driver, page_height, threshold=0.001):
+    # 返回的框使用页面坐标(CSS 像素), 跨分段的重复框通过 NMS 合并
+    device_pixel_ratio = driver.execute_script("return window.devicePixelRatio;") or 1
+    results = []
+    batch = []
 
-    return filtered_results
+    def flush():
+        detections = model_registry.detect_batch(
+            [image for image, _ in batch], ["watch"], threshold
+        )
+        for (image, scroll_y), tile_results in zip(batch, detections):
+            image.close()
+            for result in tile_results:
+                box = result["box"]
+                result["box"] = {
+                    "xmin": int(box["xmin"] / device_pixel_ratio),
+                    "ymin": int(box["ymin"] / device_pixel_ratio + scroll_y),
+                    "xmax": int(box["xmax"] / device_pixel_ratio),
+                    "ymax": int(box["ymax"] / device_pixel_ratio + scroll_y),
+                }
+                results.append(result)
+        batch.clear()
+
+    tiles = 0
+    for tile in iter_page_tiles(driver, page_height):
+        tiles += 1
+        batch.append(tile)
+        if len(batch) >= DETECTION_TILE_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    results.sort(key=lambda result: result["score"], reverse=True)
+    keep = overlapping_boxes_keep(
+        [result["box"] for result in results],
+        [result["score"] for result in results],
+        iou_threshold=0.005,
+    )
+    logging.info(f"Tiled detection: {tiles} tiles, {len(keep)} boxes kept")
+    return [results[i] for i in keep]
 
 
 async def extractWithOpenAI(question, model="gpt-35-turbo"):
-    openAiClient = AsyncAzureOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY", ""),
-        api_version=os.getenv("OPENAI_API_VERSION", ""),
-        azure_endpoint=os.getenv("OPENAI_AZURE_ENDPOINT", ""),
-    )
     messages = [
         {
             "role": "system",
@@ -259,15 +287,15 @@ async def extractWithOpenAI(question, model="gpt-35-turbo"):
         },
     ]
 
-    chat_completion = await openAiClient.chat.completions.create(
+    # 共用进程内的客户端, 并发/限流/重试都在 llm 模块中处理
+    content = await llm.complete(
+        messages,
         model=model,
         temperature=0,
         top_p=1.0,
         frequency_penalty=0,
         presence_penalty=0,
-        messages=messages,
     )
-    content = chat_completion.choices[0].message.content
 
     match = re.search(r"```json\n(.*?)\n```", content, re.DOTALL)
     if match:
@@ -284,43 +312,100 @@ async def extractWithOpenAI(question, model="gpt-35-turbo"):
     return content
 
 
-def filter_overlapping_boxes(boxes, scores, iou_threshold):
-    filtered_boxes = []
-    seen = defaultdict(bool)
+def boxes_to_tensor(boxes):
+    return torch.tensor(
+        [[box["xmin"], box["ymin"], box["xmax"], box["ymax"]] for box in boxes],
+        dtype=torch.float32,
+    ).reshape(-1, 4)
+
+
+def overlapping_boxes_keep(boxes, scores, iou_threshold):
+    # 按原来的顺序贪心保留: 一个框只会被它之前、已保留且分数更高的重叠框抑制
+    # 每保留一个框只计算一行 IoU, 内存为 O(n) 而不是 O(n²)
+    if not boxes:
+        return []
+
+    box_tensor = boxes_to_tensor(boxes)
+    score_tensor = torch.tensor(scores, dtype=torch.float32)
+    indexes = torch.arange(len(boxes))
+    suppressed = torch.zeros(len(boxes), dtype=torch.bool)
 
-    for i, box1 in enumerate(boxes):
-        if seen[i]:
+    keep = []
+    for i in range(len(boxes)):
+        if suppressed[i]:
             continue
+        keep.append(i)
+        iou = box_iou(box_tensor[i : i + 1], box_tensor)[0]
+        suppressed |= (
+            (iou > iou_threshold) & (score_tensor < score_tensor[i]) & (indexes > i)
+        )
+
+    return keep
+
+
+def filter_overlapping_boxes(boxes, scores, iou_threshold):
+    return [boxes[i] for i in overlapping_boxes_keep(boxes, scores, iou_threshold)]
+
+
+html_list_script = """
+    var points = arguments[0];
+    var itemThreshold = arguments[1];
+    var groupThreshold = arguments[2];
+
+    // 按 class 字符串缓存 token 集合和两两相似度, 同一个页面中 class 重复率很高
+    var tokenCache = {};
+    var similarityCache = {};
+
+    function classTokens(className) {
+        if (!(className in tokenCache)) {
+            // 数字通常是序号或随机后缀, 归一化后 item-1 与 item-2 视为同一个 token
+            var tokens = {};
+            var size = 0;
+            className.split(/\\s+/).forEach(function (token) {
+                token = token.replace(/\\d+/g, '#');
+                if (token && !(token in tokens)) {
+                    tokens[token] = true;
+                    size++;
+                }
+            });
+            tokenCache[className] = {tokens: tokens, size: size};
+        }
+        return tokenCache[className];
+    }
+
+    // Dice 系数, 与 token 数量成线性关系
+    function classSimilarity(a, b) {
+        if (a === b) {
+            return 1.0;
+        }
+        var key = a < b ? a + '\\u0000' + b : b + '\\u0000' + a;
+        if (!(key in similarityCache)) {
+            var tokensA = classTokens(a);
+            var tokensB = classTokens(b);
+            var shared = 0;
+            for (var token in tokensA.tokens) {
+                if (token in tokensB.tokens) {
+                    shared++;
+                }
+            }
+            var total = tokensA.size + tokensB.size;
+            similarityCache[key] = total === 0 ? 1.0 : (2 * shared) / total;
+        }
+        return similarityCache[key];
+    }
+
+    function className(element) {
+        return typeof element.className === 'string' ? element.className : '';
+    }
 
-        filtered_boxes.append(box1)
-        for j, box2 in enumerate(boxes[i + 1 :], start=i + 1):
-            box1_tensor = torch.tensor(
-                [[box1["xmin"], box1["ymin"], box1["xmax"], box1["ymax"]]]
-            )
-            box2_tensor = torch.tensor(
-                [[box2["xmin"], box2["ymin"], box2["xmax"], box2["ymax"]]]
-            )
-            iou = box_iou(box1_tensor, box2_tensor)[0][0].item()
-            if iou > iou_threshold:
-                if scores[i] > scores[j]:
-                    seen[j] = True
-                else:
-                    seen[i] = True
-
-    return filtered_boxes
-
-
-script = """
     function isListItem(element) {
         if (!element || !element.parentElement) {
             return false;
         }
         var siblings = element.parentElement.children;
-        var elementClassList = element.className;
         for (var i = 0; i < siblings.length; i++) {
             if (siblings[i] !== element && siblings[i].tagName === element.tagName) {
-                var siblingClassList = siblings[i].className;
-                if (levenshteinSimilarity(elementClassList, siblingClassList) > 0.9) { // 调整阈值
+                if (classSimilarity(className(element), className(siblings[i])) > itemThreshold) {
                     return true;
                 }
             }
@@ -340,158 +425,220 @@ script = """
         return null;
     }
 
-    var ele = document.elementFromPoint(arguments[0], arguments[1]);
-    var listParent = findListParent(ele);
-    return listParent;
-
-    """
-
-
-def inject_levenshtein_similarity(driver):
-    levenshtein_script = """
-    function levenshteinDistance(a, b) {
-        const matrix = [];
-
-        for (let i = 0; i <= b.length; i++) {
-            matrix[i] = [i];
+    // 传入的是页面坐标, 目标不在当前视口内时先滚动过去
+    var votes = new Map();
+    points.forEach(function (point) {
+        var x = point[0], y = point[1];
+        if (y < window.scrollY || y >= window.scrollY + window.innerHeight) {
+            window.scrollTo({top: Math.max(0, y - window.innerHeight / 2), left: 0, behavior: 'instant'});
         }
-
-        for (let j = 0; j <= a.length; j++) {
-            matrix[0][j] = j;
+        var element = document.elementFromPoint(x - window.scrollX, y - window.scrollY);
+        if (!element) {
+            return;
+        }
+        var parent = findListParent(element);
+        if (parent) {
+            votes.set(parent, (votes.get(parent) || 0) + 1);
         }
+    });
+
+    var mostCommonParent = null;
+    var maxVotes = 0;
+    votes.forEach(function (count, parent) {
+        if (count > maxVotes) {
+            maxVotes = count;
+            mostCommonParent = parent;
+        }
+    });
+    if (!mostCommonParent) {
+        return null;
+    }
 
-        for (let i = 1; i <= b.length; i++) {
-            for (let j = 1; j <= a.length; j++) {
-                if (b.charAt(i - 1) === a.charAt(j - 1)) {
-                    matrix[i][j] = matrix[i - 1][j - 1];
-                } else {
-                    matrix[i][j] = Math.min(
-                        matrix[i - 1][j - 1] + 1,
-                        matrix[i][j - 1] + 1,
-                        matrix[i - 1][j] + 1
-                    );
-                }
+    // 过滤掉没有有效 outerHTML 和内容为空的子元素, 再按 class 相似度分组
+    var children = Array.from(mostCommonParent.children);
+    var classGroups = [];
+    children.forEach(function (child) {
+        if (!child.outerHTML || child.outerHTML.trim() === '' || child.textContent.trim() === '') {
+            return;
+        }
+        var name = className(child);
+        for (var j = 0; j < classGroups.length; j++) {
+            if (classSimilarity(name, classGroups[j][0]) >= groupThreshold) {
+                classGroups[j].push(name);
+                return;
             }
         }
-
-        return matrix[b.length][a.length];
+        classGroups.push([name]);
+    });
+    if (classGroups.length === 0) {
+        return null;
     }
 
-    window.levenshteinSimilarity = function(a, b) {
-        const maxLen = Math.max(a.length, b.length);
-        if (maxLen === 0) return 1.0;
-        const distance = levenshteinDistance(a, b);
-        return (maxLen - distance) / maxLen;
-    }
+    // 找到包含最多元素的组
+    var mostCommonClass = classGroups.reduce(function (a, b) {
+        return a.length >= b.length ? a : b;
+    })[0];
+
+    var seen = {};
+    var htmlList = [];
+    children.forEach(function (child) {
+        if (classSimilarity(className(child), mostCommonClass) >= groupThreshold && !(child.outerHTML in seen)) {
+            seen[child.outerHTML] = true;
+            htmlList.push(child.outerHTML);
+        }
+    });
+
+    return {
+        htmlList: htmlList,
+        mostCommonClass: mostCommonClass,
+        parent: mostCommonParent.getAttribute('class') || mostCommonParent.getAttribute('id')
+    };
     """
-    driver.execute_script(levenshtein_script)
-    is_available = driver.execute_script(
-        "return typeof levenshteinSimilarity === 'function';"
-    )
-    if not is_available:
-        raise Exception("levenshteinSimilarity function not available after injection.")
 
 
 def get_html_list(watch_boxes, driver):
     if not watch_boxes or not driver:
         return None, None
 
-    inject_levenshtein_similarity(driver)
-
     try:
-        watches = [
-            {"x": watch["box"]["xmin"], "y": watch["box"]["ymin"]}
+        points = [
+            [watch["box"]["xmin"] + 5, watch["box"]["ymin"] + 5]
             for watch in watch_boxes
         ]
 
-        parent_elements = [
-            driver.execute_script(script, watch["x"] + 5, watch["y"] + 5)
-            for watch in watches
-        ]
+        # 所有检测框的定位、投票和子元素分组在一次 execute_script 中完成
+        result = driver.execute_script(html_list_script, points, 0.9, 0.8)
+        if not result:
+            return None, None
 
-        parent_elements = [dom for dom in parent_elements if dom is not None]
+        logging.info(f"most_common_class------------{result['mostCommonClass']}")
 
-        if not parent_elements:
-            return None, None
+        return result["htmlList"], result["parent"]
+    except Exception as e:
+        logging.info(f"Error: {e}")
+        return None, None
 
-        counter = Counter(parent_elements)
-        most_common_parent = counter.most_common(1)[0][0]
 
-        if not most_common_parent:
-            return None, None
+dom_listing_script = """
+    var minItems = arguments[0];
+    var pricePattern = /(?:[$€£¥₹]|\\b(?:USD|EUR|GBP|CHF|HKD|JPY|CNY|AUD|CAD|SGD)\\b)\\s?\\d|\\d[\\d.,\\s]*\\s?(?:[$€£¥₹]|\\b(?:USD|EUR|GBP|CHF|HKD|JPY|CNY|AUD|CAD|SGD)\\b)/i;
 
-        most_common_class = driver.execute_script(
-            """
-            var parent = arguments[0];
-            var threshold = 0.8;
-            var children = parent.children;
-            var classNames = [];
-            
-            for (var i = 0; i < children.length; i++) {
-                // 过滤掉没有有效 outerHTML 和内容为空的元素
-                if (children[i].outerHTML && children[i].outerHTML.trim() !== '' && children[i].textContent.trim() !== '') {
-                    console.log('item class name: ' + children[i].className);
-                    classNames.push(children[i].className);
-                }
+    // 结构签名: tag + 排序后的 class, 忽略带数字的 class(通常是序号或随机后缀)
+    function signature(element) {
+        var classes = Array.from(element.classList).filter(function (cls) {
+            return !/\\d/.test(cls);
+        });
+        classes.sort();
+        return element.tagName + '.' + classes.join('.');
+    }
+
+    function median(values) {
+        var sorted = values.slice().sort(function (a, b) { return a - b; });
+        return sorted[Math.floor(sorted.length / 2)];
+    }
+
+    // 返回每个值是否与其他某个值相差不超过 tolerance, 即与其他元素处在同一行/同一列
+    function sharesLine(values, tolerance) {
+        var order = values.map(function (value, index) { return index; });
+        order.sort(function (a, b) { return values[a] - values[b]; });
+        var shared = values.map(function () { return false; });
+        for (var i = 1; i < order.length; i++) {
+            if (values[order[i]] - values[order[i - 1]] <= tolerance) {
+                shared[order[i]] = true;
+                shared[order[i - 1]] = true;
             }
-            
-            // 使用字典记录相似的类名组
-            var classGroups = [];
-            
-            for (var i = 0; i < classNames.length; i++) {
-                var foundGroup = false;
-                for (var j = 0; j < classGroups.length; j++) {
-                    if (levenshteinSimilarity(classNames[i], classGroups[j][0]) >= threshold) {
-                        classGroups[j].push(classNames[i]);
-                        foundGroup = true;
-                        break;
-                    }
-                }
-                if (!foundGroup) {
-                    classGroups.push([classNames[i]]);
-                }
+        }
+        return shared;
+    }
+
+    var best = null;
+    var parents = document.body.querySelectorAll('*');
+    for (var p = 0; p < parents.length; p++) {
+        var parent = parents[p];
+        if (parent.children.length < minItems) {
+            continue;
+        }
+
+        var groups = {};
+        for (var c = 0; c < parent.children.length; c++) {
+            var child = parent.children[c];
+            var key = signature(child);
+            (groups[key] = groups[key] || []).push(child);
+        }
+
+        for (var key in groups) {
+            var items = groups[key];
+            if (items.length < minItems) {
+                continue;
             }
-            
-            // 找到包含最多元素的组
-            var mostCommonGroup = classGroups.reduce(function(a, b) {
-                return a.length > b.length ? a : b;
-            });
-            var mostCommonClass = mostCommonGroup[0];
-            
-            return mostCommonClass;
-            """,
-            most_common_parent,
-        )
 
-        logging.info(f"most_common_class------------{most_common_class}")
+            var rects = items.map(function (item) { return item.getBoundingClientRect(); });
+            var visible = rects.filter(function (rect) { return rect.width > 0 && rect.height > 0; });
+            if (visible.length < minItems) {
+                continue;
+            }
 
-        children_html_list = driver.execute_script(
-            """
-            var parent = arguments[0];
-            var mostCommonClass = arguments[1];
-            var threshold = 0.8;
-            var children = parent.children;
-            var htmlList = [];
-            
-            for (var i = 0; i < children.length; i++) {
-                var className = children[i].className;
-                var similarity = levenshteinSimilarity(className, mostCommonClass);
-                if (similarity >= threshold) {
-                    htmlList.push(children[i].outerHTML);
-                }
+            // 网格/列表中的卡片宽度基本一致, 并且与其他卡片顶部同行或左侧同列
+            var width = median(visible.map(function (rect) { return rect.width; }));
+            var inRow = sharesLine(visible.map(function (rect) { return rect.top; }), 2);
+            var inColumn = sharesLine(visible.map(function (rect) { return rect.left; }), 2);
+            var aligned = visible.filter(function (rect, index) {
+                return Math.abs(rect.width - width) <= width * 0.1 && (inRow[index] || inColumn[index]);
+            }).length;
+            var withImage = items.filter(function (item) {
+                return item.querySelector('img, picture, [style*="background-image"]') !== null;
+            }).length;
+            var withPrice = items.filter(function (item) {
+                return pricePattern.test(item.textContent);
+            }).length;
+
+            var candidate = {
+                parent: parent,
+                items: items,
+                count: items.length,
+                alignedRatio: aligned / items.length,
+                imageRatio: withImage / items.length,
+                priceRatio: withPrice / items.length
+            };
+            candidate.score = candidate.count * candidate.alignedRatio * candidate.imageRatio * candidate.priceRatio;
+            if (best === null || candidate.score > best.score) {
+                best = candidate;
             }
-            return htmlList;
-            """,
-            most_common_parent,
-            most_common_class,
-        )
+        }
+    }
 
-        return list(set(children_html_list)), most_common_parent.get_attribute(
-            "class"
-        ) or most_common_parent.get_attribute("id")
-    except Exception as e:
-        logging.info(f"Error: {e}")
-        return None, None
+    if (best === null) {
+        return null;
+    }
+    return {
+        htmlList: best.items.map(function (item) { return item.outerHTML; }),
+        parent: best.parent.getAttribute('class') || best.parent.getAttribute('id'),
+        count: best.count,
+        alignedRatio: best.alignedRatio,
+        imageRatio: best.imageRatio,
+        priceRatio: best.priceRatio
+    };
+    """
+
+
+def get_dom_listing(driver, min_items=DOM_FAST_PATH_MIN_ITEMS):
+    # 一次 execute_script 中找出最大的一组对齐、带图片和价格的相似兄弟节点
+    start_time = time.perf_counter()
+    candidate = driver.execute_script(dom_listing_script, min_items)
+    metrics.observe("dom_fast_path.seconds", time.perf_counter() - start_time)
+
+    if not candidate:
+        return [], None, 0.0
+
+    confidence = (
+        candidate["alignedRatio"] * candidate["imageRatio"] * candidate["priceRatio"]
+    )
+    logging.info(
+        f"DOM listing candidate: {candidate['count']} items, parent={candidate['parent']}, "
+        f"aligned {candidate['alignedRatio']:.2f}, image {candidate['imageRatio']:.2f}, "
+        f"price {candidate['priceRatio']:.2f}, confidence {confidence:.2f}"
+    )
+    return candidate["htmlList"], candidate["parent"], confidence
 
 
 def handle_popup(driver):
@@ -565,94 +712,111 @@ def handle_popup(driver):
     return driver.execute_script(script)
 
 
-session = aioboto3.Session()
-
+async def upload_html_to_s3(html_content, content_type="text/html", url=None):
+    # 返回快照名称(内容哈希)并放入后台归档队列, 不等待上传完成
+    # 传入 url 时会记录该地址最新的快照
+    return archive.submit(html_content, content_type, url)
 
-async def upload_html_to_s3(html_content):
-    # 从环境变量中获取 AWS 相关配置
-    aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID", "")
-    aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY", "")
 
-    bucket_name = os.getenv("S3_BUCKET_NAME", "")
-    object_name = os.getenv("S3_BUCKET_HTML_SAVE_PATH", "")
-    region_name = os.getenv("S3_BUCKET_REGION_NAME", "")
-
-    # 检查 HTML 内容是否存在
-    if not html_content:
-        logging.info("Error: No HTML content provided.")
-        return None
-
-    # 检查是否所有必要的环境变量都有值
-    if not all([aws_access_key_id, aws_secret_access_key, bucket_name, object_name]):
-        logging.info("Error: Missing environment variables.")
-        return None
-
-    # 生成唯一的文件名
-    uuid_v4 = str(uuid.uuid4())
-    object_name = f"{object_name}/{uuid_v4}"
-
-    # 使用 aioboto3 进行异步 S3 客户端的操作
-    async with session.client(
-        "s3",
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=region_name,
-    ) as s3:
-        try:
-            # 异步上传 HTML 内容到 S3
-            await s3.put_object(
-                Bucket=bucket_name,
-                Key=object_name,
-                Body=html_content,
-                ContentType="text/html",  # 设置内容类型为 HTML
-            )
-            logging.info(f"Successfully uploaded to {bucket_name}/{object_name}")
-            return uuid_v4
-        except NoCredentialsError:
-            logging.info("Error: No AWS credentials found.")
-        except PartialCredentialsError:
-            logging.info("Error: Incomplete AWS credentials found.")
-        except Exception as e:
-            logging.info(f"Error uploading to S3: {e}")
-            return None
+def _structure_ids(tags, index_of):
+    # 自下而下为每个元素分配结构编号, 编号相同等价于 bs4 的 Tag.__eq__(名称/属性/内容递归相同)
+    # ordered 还区分属性顺序, 对应 Counter 按 str(tag) 的哈希对父节点分组
+    equal_ids, ordered_ids = [0] * len(tags), [0] * len(tags)
+    equal_keys, ordered_keys = {}, {}
+    for i in range(len(tags) - 1, -1, -1):
+        tag = tags[i]
+        attrs = [
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in tag.attrs.items()
+        ]
+        equal_contents, ordered_contents = [], []
+        for child in tag.contents:
+            if child.name is None:
+                equal_contents.append(str(child))
+                ordered_contents.append(str(child))
+            else:
+                child_index = index_of[id(child)]
+                equal_contents.append(equal_ids[child_index])
+                ordered_contents.append(ordered_ids[child_index])
+        equal_key = (tag.name, frozenset(attrs), tuple(equal_contents))
+        ordered_key = (tag.name, tuple(attrs), tuple(ordered_contents))
+        equal_ids[i] = equal_keys.setdefault(equal_key, len(equal_keys))
+        ordered_ids[i] = ordered_keys.setdefault(ordered_key, len(ordered_keys))
+    return equal_ids, ordered_ids
+
+
+def _rank_list_parents(root):
+    # 与原来的实现结果完全一致: 对每个元素向上查找(到 body 为止), 第一个"父节点的后代中存在
+    # 同 tag、共享 class 且结构不同的其他元素"的祖先(含自身), 它的父节点就是该元素的列表父节点
+    # 原来每一层都对父节点做一次递归 find_all, 这里按先序编号把子树变成区间, 用二分计数, O(n log n)
+    # root 为整个文档, 或者 HTML 片段被 lxml 补上的 <body>, 此时把它当作文档本身
+    tags = root.find_all(True)
+    index_of = {id(tag): i for i, tag in enumerate(tags)}
+    parent_indexes = [index_of.get(id(tag.parent), -1) for tag in tags]
+
+    # 子树区间: 元素 i 的后代为先序编号 (i, ends[i]], 整个文档为 [0, n)
+    sizes = [1] * len(tags)
+    for i in range(len(tags) - 1, -1, -1):
+        if parent_indexes[i] >= 0:
+            sizes[parent_indexes[i]] += sizes[i]
+    ends = [i + sizes[i] - 1 for i in range(len(tags))]
+
+    equal_ids, ordered_ids = _structure_ids(tags, index_of)
+    by_class = defaultdict(list)
+    by_structure = defaultdict(list)
+    for i, tag in enumerate(tags):
+        for class_name in set(tag.get("class", [])):
+            by_class[(tag.name, class_name)].append(i)
+        by_structure[(tag.name, equal_ids[i])].append(i)
+
+    def count_in_subtree(positions, parent_index):
+        if parent_index < 0:
+            return len(positions)
+        return bisect_right(positions, ends[parent_index]) - bisect_right(
+            positions, parent_index
+        )
 
+    list_parents = [None] * len(tags)
+    counts = Counter()
+    representatives = {}
+    for i, tag in enumerate(tags):
+        parent = tag.parent
+        parent_index = parent_indexes[i]
+        if parent.name == "body" and parent is not root:
+            continue
 
-def is_list_item(element):
-    if not element or not element.parent:
-        return False
-    siblings = element.parent.find_all(element.name)
-    for sibling in siblings:
-        if sibling != element:
-            element_classes = set(element.get("class", []))
-            sibling_classes = set(sibling.get("class", []))
-            if element_classes & sibling_classes:
-                return True
-    return False
+        classes = set(tag.get("class", []))
+        same = count_in_subtree(by_structure[(tag.name, equal_ids[i])], parent_index)
+        if any(
+            count_in_subtree(by_class[(tag.name, class_name)], parent_index) > same
+            for class_name in classes
+        ):
+            list_parents[i] = parent
+        elif parent_index >= 0:
+            list_parents[i] = list_parents[parent_index]
 
+        list_parent = list_parents[i]
+        if list_parent is not None:
+            key = ordered_ids[index_of[id(list_parent)]] if list_parent is not root else -1
+            counts[key] += 1
+            representatives.setdefault(key, list_parent)
 
-def find_list_parent(element):
-    parent = element.parent
-    while parent and parent.name != "body":
-        if is_list_item(element):
-            return parent
-        element = parent
-        parent = parent.parent
-    return None
+    return [(representatives[key], count) for key, count in counts.most_common()]
 
 
 def get_api_html_list(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    all_elements = soup.find_all(True)
-
-    parent_elements = []
-    for element in all_elements:
-        list_parent = find_list_parent(element)
-        if list_parent:
-            parent_elements.append(list_parent)
+    # lxml 解析比 html.parser 快数倍, 大响应在 html.parser 下解析时间超过线性增长
+    # 两者的树只在不规范的 HTML 上不同(如 <p> 内的块级元素、表格外的 <tr>/<td>、自动补全的 <head>)
+    soup = BeautifulSoup(html_content, "lxml")
+    # lxml 会给 HTML 片段补上 <html><body>, 片段的顶层元素应当和 html.parser 一样位于文档根部
+    body_tag = rb"<body[\s>]" if isinstance(html_content, bytes) else r"<body[\s>]"
+    is_fragment = re.search(body_tag, html_content, re.IGNORECASE) is None
+    root = soup.body if is_fragment and soup.body is not None else soup
+    candidates = _rank_list_parents(root)
 
     # 如果没有找到任何 parent_elements，检查是否只有一个顶层元素
-    if not parent_elements:
-        parent_element = soup.find(True)
+    if not candidates:
+        parent_element = root.find(True)
         if parent_element:
             children_html_list = [
                 str(child) for child in parent_element.find_all(recursive=False)
@@ -661,9 +825,14 @@ def get_api_html_list(html_content):
         else:
             return [], ""
 
-    # 统计每个 parent 元素的引用
-    counter = Counter(parent_elements)
-    most_common_parent, _ = counter.most_common(1)[0]
+    most_common_parent, _ = candidates[0]
+    logging.info(
+        "List container candidates: "
+        + ", ".join(
+            f"{parent.name}.{'.'.join(parent.get('class', []))}={count}"
+            for parent, count in candidates[:3]
+        )
+    )
 
     # 获取出现次数最多的 parent 元素的所有子元素的 outerHTML
     children_html_list = []
@@ -687,30 +856,27 @@ def _json_to_text(json_data):
         return str(json_data)
 
 
-def _is_watch_related(text):
-    if not text.strip():  # 检查文本是否为空
-        return 0.0
-    current_file_path = os.path.abspath(__file__)
-    current_dir = os.path.dirname(current_file_path)
-    model_path = os.path.join(current_dir, "bart-large-mnli")
-
-    # 加载模型和处理器
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
-    candidate_labels = ["watch", "not watch"]
-    _classifier = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
-
-    result = _classifier(text, candidate_labels)
-    score = (
-        result["scores"][0] if result["labels"][0] == "watch" else result["scores"][1]
+def _score_watch_related(texts, batch_size=None):
+    scores = [0.0] * len(texts)
+    # 空文本不需要送入模型
+    indexes = [i for i, text in enumerate(texts) if text.strip()]
+    results = model_registry.classify(
+        [texts[i] for i in indexes], ["watch", "not watch"], batch_size=batch_size
     )
+
     watch_related_fields = ["price", "brand", "reference"]
-    # 如果text中包含关键字段，则加1分
-    for field in watch_related_fields:
-        if field in text.lower():
+    for i, result in zip(indexes, results):
+        score = result["watch"]
+        # 如果text中包含关键字段，则加1分
+        lower_text = texts[i].lower()
+        if any(field in lower_text for field in watch_related_fields):
             score += 1
-            break
-    return score
+        scores[i] = score
+    return scores
+
+
+def _is_watch_related(text):
+    return _score_watch_related([text])[0]
 
 
 # 递归查找JSON中的所有数组
@@ -728,17 +894,32 @@ def _find_all_arrays(json_data):
 
 
 # 查找与手表相关性最高的数组
-def find_most_related_array(json_data):
-    arrays = _find_all_arrays(json_data)
+def find_most_related_array(json_data, batch_size=None):
+    best_array, _, max_score = find_most_related_array_in(
+        [(None, json_data)], batch_size=batch_size
+    )
+    return best_array, max_score
+
+
+# 在多个 JSON 响应中查找与手表相关性最高的数组, 所有数组在一次分类中打分
+def find_most_related_array_in(sources, batch_size=None):
+    candidates = [
+        (source, array)
+        for source, json_data in sources
+        for array in _find_all_arrays(json_data)
+    ]
+    texts = [_json_to_text(array) for _, array in candidates]
+    scores = _score_watch_related(texts, batch_size=batch_size)
+
     max_score = 0
     best_array = None
-    for array in arrays:
-        text = _json_to_text(array)
-        score = _is_watch_related(text)
+    best_source = None
+    for (source, array), score in zip(candidates, scores):
         if score > max_score:
             max_score = score
             best_array = array
-    return best_array, max_score
+            best_source = source
+    return best_array, best_source, max_score
 
 
 def calculate_area(box):
@@ -748,7 +929,6 @@ def calculate_area(box):
 
 
 def get_detail_images_html(watch_boxes, driver):
-    inject_levenshtein_similarity(driver)
     if not watch_boxes:
         return None
     if not driver:
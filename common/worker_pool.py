@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from common import metrics
+
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "2"))
+# 每个 worker 执行 N 个任务后重启, 或者常驻内存超过上限后重启
+WORKER_MAX_TASKS = int(os.getenv("WORKER_MAX_TASKS", "50"))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "4096"))
+WORKER_PRELOAD_MODELS = os.getenv("WORKER_PRELOAD_MODELS", "1") == "1"
+
+
+def get_rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _init_worker():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    logging.getLogger("seleniumwire").setLevel(logging.ERROR)
+    logging.getLogger("WDM").setLevel(logging.ERROR)
+    logging.getLogger("urllib3").setLevel(logging.ERROR)
+    logging.getLogger("watchfiles.watcher").setLevel(logging.ERROR)
+
+    start_time = time.perf_counter()
+    # 预先导入 torch / transformers / selenium-wire 并加载模型
+    from common import utils, model_registry, driver_pool  # noqa: F401
+
+    if WORKER_PRELOAD_MODELS:
+        model_registry.get_detector()
+        model_registry.get_classifier()
+
+    if driver_pool.DRIVER_PRELOAD:
+        try:
+            driver_pool.pool.start()
+        except Exception as e:
+            logging.error(f"Error warming up driver pool: {e}")
+
+    metrics.observe("worker.cold_start_seconds", time.perf_counter() - start_time)
+    logging.info(
+        f"Worker {os.getpid()} ready in {time.perf_counter() - start_time:.2f} seconds"
+    )
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _run_task(fn, args, kwargs):
+    result = fn(*args, **kwargs)
+    # 把 worker 内产生的指标带回主进程
+    return result, metrics.snapshot(reset=True), get_rss_mb()
+
+
+class _Worker:
+    def __init__(self, context):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=context, initializer=_init_worker
+        )
+        self.tasks = 0
+
+
+class WorkerPool:
+    def __init__(self, size=WORKER_POOL_SIZE):
+        self.size = size
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.idle = None
+        self.recycled = 0
+        self.pending_warm_ups = set()
+
+    async def start(self):
+        self.idle = asyncio.Queue()
+        await asyncio.gather(*[self._add_worker() for _ in range(self.size)])
+        logging.info(f"Worker pool started with {self.size} workers")
+
+    async def stop(self):
+        for task in self.pending_warm_ups:
+            task.cancel()
+        for worker in self.workers:
+            worker.executor.shutdown(wait=False, cancel_futures=True)
+        self.workers = []
+
+    async def _add_worker(self):
+        worker = _Worker(self.context)
+        self.workers.append(worker)
+        try:
+            # 提交一个空任务, 让进程启动并完成模型预加载
+            await asyncio.wrap_future(worker.executor.submit(_warm_up))
+        except Exception as e:
+            logging.error(f"Worker warm up failed: {e}")
+        self.idle.put_nowait(worker)
+
+    def _recycle(self, worker, reason):
+        logging.info(f"Recycle worker after {worker.tasks} tasks: {reason}")
+        metrics.incr("worker.recycled")
+        self.recycled += 1
+        self.workers.remove(worker)
+        worker.executor.shutdown(wait=False, cancel_futures=True)
+
+        task = asyncio.create_task(self._add_worker())
+        self.pending_warm_ups.add(task)
+        task.add_done_callback(self.pending_warm_ups.discard)
+
+    def _release(self, worker, rss=0.0):
+        worker.tasks += 1
+        if worker.tasks >= WORKER_MAX_TASKS:
+            self._recycle(worker, "max tasks reached")
+        elif rss > WORKER_MAX_RSS_MB:
+            self._recycle(worker, f"rss {rss:.0f} MB over limit")
+        else:
+            self.idle.put_nowait(worker)
+
+    async def run(self, fn, *args, **kwargs):
+        start_time = time.perf_counter()
+        worker = await self.idle.get()
+        metrics.observe("worker.queue_wait_seconds", time.perf_counter() - start_time)
+
+        future = worker.executor.submit(_run_task, fn, args, kwargs)
+        try:
+            result, worker_metrics, rss = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._recycle(worker, "process died")
+            raise
+        except asyncio.CancelledError:
+            # 请求被取消时任务仍在 worker 中执行, 等它结束后再归还
+            loop = asyncio.get_running_loop()
+            future.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(self._release, worker)
+            )
+            raise
+        except Exception:
+            self._release(worker)
+            raise
+
+        metrics.merge(worker_metrics)
+        metrics.incr("worker.tasks")
+        self._release(worker, rss)
+        return result
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "workers": len(self.workers),
+            "idle": self.idle.qsize() if self.idle else 0,
+            "recycled": self.recycled,
+        }
+
+
+pool = WorkerPool()
+
+
+async def run(fn, *args, **kwargs):
+    return await pool.run(fn, *args, **kwargs)
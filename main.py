@@ -1,13 +1,21 @@
 import warnings
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+
+# 先加载 .env, 各模块在导入时会读取配置
+load_dotenv(override=True)
+
 from fastapi import FastAPI
 from routes.scrap_list_browser import router as scrap_list_browser_router
 from routes.scrap_list_html import router as scrap_list_html_router
 from routes.scrap_list_json import router as scrap_list_json_router
 from routes.scrap_detail import router as scrap_detail_router
-
-load_dotenv(override=True)
+from routes.reprocess import router as reprocess_router
+from routes.jobs import router as jobs_router
+from routes.scrap_batch import router as scrap_batch_router
+from routes.metrics import router as metrics_router
+from common import worker_pool, llm, fetcher, archive, jobs
 
 warnings.filterwarnings("ignore", category=RuntimeWarning, message=".*TLS in TLS.*")
 logging.basicConfig(
@@ -16,9 +24,28 @@ logging.basicConfig(
 
 logging.getLogger("httpx").setLevel(logging.ERROR)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动常驻 worker 进程, 所有路由共享
+    await worker_pool.pool.start()
+    archive.start()
+    jobs.start()
+    yield
+    await jobs.stop()
+    await archive.stop()
+    await worker_pool.pool.stop()
+    await llm.close()
+    await fetcher.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(scrap_list_browser_router)
 app.include_router(scrap_list_html_router)
 app.include_router(scrap_list_json_router)
 app.include_router(scrap_detail_router)
+app.include_router(reprocess_router)
+app.include_router(jobs_router)
+app.include_router(scrap_batch_router)
+app.include_router(metrics_router)
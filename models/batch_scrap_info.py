@@ -0,0 +1,15 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel
+from models.scrap_list_info import ScrapListInfo
+
+
+class BatchScrapItem(ScrapListInfo):
+    # 使用哪个抓取流程, 其余字段与对应的单个接口相同
+    pipeline: Literal["html", "json", "browser"] = "html"
+    parent: Optional[str] = None
+    tiled: Optional[bool] = None
+    blocking_profile: Optional[Literal["none", "balanced", "minimal"]] = None
+
+
+class BatchScrapInfo(BaseModel):
+    items: List[BatchScrapItem]
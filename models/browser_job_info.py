@@ -0,0 +1,9 @@
+from typing import Optional
+from models.scrap_list_browser_info import ScrapListBrowserInfo
+
+
+class BrowserJobInfo(ScrapListBrowserInfo):
+    # 数字越大越先执行
+    priority: Optional[int] = 0
+    # 任务完成后把任务状态和结果 POST 到这个地址
+    webhook: Optional[str] = None
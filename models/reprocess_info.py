@@ -0,0 +1,12 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class ReprocessInfo(BaseModel):
+    # 二选一: 归档快照名称(s3_uuid) 或 REPROCESS_ROOT 下的本地快照目录
+    s3_uuids: Optional[List[str]] = None
+    directory: Optional[str] = None
+    # 默认从归档清单中查找快照对应的域名
+    domain: Optional[str] = None
+    detail_url_template: Optional[str] = None
+    concurrency: Optional[int] = None
@@ -1,7 +1,11 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel
 
 
 class ScrapListBrowserInfo(BaseModel):
     url: str
     parent: Optional[str] = None
+    # 是否分段截图检测, 默认按页面高度自动选择
+    tiled: Optional[bool] = None
+    # 请求拦截 profile, 默认使用 BLOCKING_PROFILE 环境变量
+    blocking_profile: Optional[Literal["none", "balanced", "minimal"]] = None
@@ -0,0 +1,49 @@
+import json
+import asyncio
+import logging
+import argparse
+from dotenv import load_dotenv
+
+# 先加载 .env, 各模块在导入时会读取配置
+load_dotenv(override=True)
+
+from common import reprocess, worker_pool, archive, llm
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logging.getLogger("httpx").setLevel(logging.ERROR)
+
+
+async def main(args):
+    # python reprocess.py --dir snapshots/2024-06 --output results.jsonl
+    if args.dir:
+        sources = reprocess.directory_sources(args.dir)
+    else:
+        sources = reprocess.s3_sources(args.s3_uuids)
+
+    await worker_pool.pool.start()
+    try:
+        with open(args.output, "w", encoding="utf-8") as f:
+            async for result in reprocess.run(
+                sources, args.concurrency, args.domain, args.detail_url_template
+            ):
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        await worker_pool.pool.stop()
+        await archive.stop()
+        await llm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run extraction on snapshots")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="local directory of snapshots")
+    source.add_argument("--s3-uuids", nargs="+", help="archived snapshot names")
+    parser.add_argument("--domain", help="domain used in the extraction prompt")
+    parser.add_argument("--detail-url-template")
+    parser.add_argument(
+        "--concurrency", type=int, default=reprocess.REPROCESS_CONCURRENCY
+    )
+    parser.add_argument("--output", default="reprocess.jsonl")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from common import jobs
+from models.browser_job_info import BrowserJobInfo
+from models.scrap_list_browser_info import ScrapListBrowserInfo
+from routes.scrap_list_browser import scrap_list_browser
+
+router = APIRouter(tags=["Jobs api"])
+
+
+async def run_browser_job(request):
+    return await scrap_list_browser(ScrapListBrowserInfo(**request))
+
+
+jobs.register("browser", run_browser_job)
+
+
+@router.post("/jobs/scrap/list/browser", status_code=202)
+async def submitBrowserJob(info: BrowserJobInfo):
+    request = info.model_dump(exclude={"priority", "webhook"})
+    try:
+        job_id, status = jobs.submit(
+            "browser", request, priority=info.priority or 0, webhook=info.webhook
+        )
+    except jobs.QueueFull as e:
+        # 队列和延后名额都满了, 让客户端稍后重试
+        return JSONResponse(
+            status_code=429, content={"message": str(e)}, headers={"Retry-After": "60"}
+        )
+    return {"job_id": job_id, "status": status}
+
+
+@router.get("/jobs/{job_id}")
+async def getJob(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("result")
+    return job
+
+
+@router.get("/jobs/{job_id}/result")
+async def getJobResult(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] not in (jobs.SUCCEEDED, jobs.FAILED):
+        return JSONResponse(
+            status_code=202, content={"job_id": job_id, "status": job["status"]}
+        )
+    return job
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from common import metrics, worker_pool, fetcher, jobs, scheduler
+
+router = APIRouter(tags=["Metrics api"])
+
+
+@router.get("/metrics")
+async def getMetrics():
+    return {
+        "worker_pool": worker_pool.pool.stats(),
+        "fetch_hosts": fetcher.stats(),
+        "jobs": jobs.stats(),
+        "crawl": scheduler.stats(),
+        **metrics.snapshot(),
+    }
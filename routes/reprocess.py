@@ -0,0 +1,35 @@
+import json
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from common import reprocess
+from models.reprocess_info import ReprocessInfo
+
+router = APIRouter(tags=["Reprocess api"])
+
+
+@router.post("/reprocess")
+async def reprocessSnapshots(info: ReprocessInfo):
+    if bool(info.s3_uuids) == bool(info.directory):
+        raise HTTPException(
+            status_code=400, detail="Provide either s3_uuids or directory"
+        )
+
+    if info.directory:
+        try:
+            directory = reprocess.resolve_directory(info.directory)
+            sources = reprocess.directory_sources(directory)
+        except (ValueError, OSError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        sources = reprocess.s3_sources(info.s3_uuids)
+
+    print(f"Reprocess {len(sources)} snapshots")
+
+    # 每完成一个快照输出一行 JSON, 带上当前进度
+    async def stream():
+        async for result in reprocess.run(
+            sources, info.concurrency, info.domain, info.detail_url_template
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,90 @@
+import os
+import json
+import asyncio
+import logging
+from urllib.parse import urlparse
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from common import scheduler, metrics
+from models.batch_scrap_info import BatchScrapInfo, BatchScrapItem
+from models.scrap_list_info import ScrapListInfo
+from models.scrap_list_browser_info import ScrapListBrowserInfo
+from routes.scrap_list_html import scrap_list_html
+from routes.scrap_list_json import scrap_list_json
+from routes.scrap_list_browser import scrap_list_browser
+
+router = APIRouter(tags=["Scrap api"])
+
+CRAWL_MAX_BATCH = int(os.getenv("CRAWL_MAX_BATCH", "10000"))
+
+
+async def scrap_item(item: BatchScrapItem):
+    # 调用不带兜底异常处理的流程, 抓取失败时抛出异常, 由 run_batch 记为失败
+    if item.pipeline == "browser":
+        info = ScrapListBrowserInfo(
+            **item.model_dump(include=set(ScrapListBrowserInfo.model_fields))
+        )
+        return await scrap_list_browser(info)
+
+    info = ScrapListInfo(**item.model_dump(include=set(ScrapListInfo.model_fields)))
+    if item.pipeline == "json":
+        return await scrap_list_json(info)
+    return await scrap_list_html(info)
+
+
+async def run_batch(items):
+    # 按完成顺序逐个返回结果, 并发由全局调度器按站点控制
+    total = len(items)
+
+    async def process(index, item):
+        async with scheduler.slot(urlparse(item.url).netloc):
+            try:
+                result = await scrap_item(item)
+            except Exception as e:
+                logging.error(f"Error crawling {item.url}: {e}")
+                metrics.incr("crawl.failed")
+                metrics.incr(f"crawl.{item.pipeline}.failed")
+                return {
+                    "index": index,
+                    "url": item.url,
+                    "pipeline": item.pipeline,
+                    "error": str(e),
+                }
+            metrics.incr("crawl.succeeded")
+            metrics.incr(f"crawl.{item.pipeline}.succeeded")
+            return {
+                "index": index,
+                "url": item.url,
+                "pipeline": item.pipeline,
+                "result": result,
+            }
+
+    tasks = [
+        asyncio.create_task(process(index, item)) for index, item in enumerate(items)
+    ]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            result = await task
+            result["progress"] = {"done": done, "total": total}
+            yield result
+    finally:
+        # 客户端断开时取消还没完成的抓取
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/scrap/batch")
+async def scrapBatch(info: BatchScrapInfo):
+    if len(info.items) > CRAWL_MAX_BATCH:
+        raise HTTPException(
+            status_code=400, detail=f"At most {CRAWL_MAX_BATCH} items per batch"
+        )
+
+    print(f"Scrap batch of {len(info.items)} urls")
+
+    # 每完成一个地址输出一行 JSON
+    async def stream():
+        async for result in run_batch(info.items):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
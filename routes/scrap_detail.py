@@ -1,54 +1,45 @@
 import io
 import json
-import asyncio
 from urllib.parse import urlparse
 from fastapi import APIRouter, Body
-from common import utils
+from common import utils, worker_pool, driver_pool, readiness, capture
 from PIL import Image
-from concurrent.futures import ProcessPoolExecutor
 
 router = APIRouter(tags=["Scrap api"])
 
 def run_selenium_scraping(url: str):
+    image = None
     try:
-        driver, temp_dirs = utils.get_driver()
-        driver.get(url)
-        utils.wait_for_requests_to_complete(driver)
-        utils.handle_popup(driver)
+        # 从进程内的浏览器池中取出一个已启动的 Chrome, 用完后重置状态归还
+        with driver_pool.acquire() as driver:
+            capture.set_scope(driver, url)
+            driver.get(url)
+            readiness.wait_until_ready(driver, stages=("network", "dom"))
+            utils.handle_popup(driver)
 
-        driver.set_window_size(1920, 2000)
+            driver.set_window_size(1920, 2000)
 
-        text = driver.execute_script("return document.body.innerText")
-        screenshot = driver.get_screenshot_as_png()
-        image = Image.open(io.BytesIO(screenshot))
-        watch_boxes = utils.watch_detect(image, threshold=0.05)
+            text = driver.execute_script("return document.body.innerText")
+            screenshot = driver.get_screenshot_as_png()
+            image = Image.open(io.BytesIO(screenshot))
+            del screenshot
+            watch_boxes = utils.watch_detect(image, threshold=0.05)
 
-        images_html = utils.get_detail_images_html(watch_boxes, driver)
-        return text, images_html, None
+            images_html = utils.get_detail_images_html(watch_boxes, driver)
+            return text, images_html, None
     except Exception as e:
         print(e)
         return None, None, {"error": str(e)}
     finally:
-        utils.clean_up_driver(driver, temp_dirs)
         # 释放内存
-        image.close()
-        del image
-        del screenshot
-        del text
-        del temp_dirs
-        del watch_boxes
-        driver.quit()
+        if image is not None:
+            image.close()
 
 
 @router.post("/scrap/detail")
 async def scrapDetail(url: str = Body(..., embed=True)):
-    loop = asyncio.get_event_loop()
-    
-    # 使用 `with` 管理 ProcessPoolExecutor，以确保其在请求结束时关闭
-    with ProcessPoolExecutor(max_workers=1) as executor:
-        text, images_html, error = await loop.run_in_executor(
-            executor, run_selenium_scraping, url
-        )
+    # 在常驻 worker 进程中执行, 模型和依赖已经预加载
+    text, images_html, error = await worker_pool.run(run_selenium_scraping, url)
 
     if error is not None:
         return error
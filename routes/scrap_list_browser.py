@@ -1,4 +1,3 @@
-import asyncio
 import base64
 import io
 import json
@@ -6,159 +5,189 @@ import logging
 import gc
 from urllib.parse import urlparse
 from fastapi import APIRouter
-from common import utils
+from common import utils, worker_pool, driver_pool, extraction, metrics, readiness, capture
 from PIL import Image
-from time import sleep
 from selenium.webdriver.common.by import By
-from concurrent.futures import ProcessPoolExecutor
 
 from models.scrap_list_browser_info import ScrapListBrowserInfo
 
 router = APIRouter(tags=["Scrap api"])
 
 def run_selenium_scraping(info: ScrapListBrowserInfo):
-    logging.basicConfig(
-        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-    )
-    logging.getLogger("seleniumwire").setLevel(logging.ERROR)
-    logging.getLogger("WDM").setLevel(logging.ERROR)
-    logging.getLogger("urllib3").setLevel(logging.ERROR)
-    logging.getLogger("watchfiles.watcher").setLevel(logging.ERROR)
-
-    driver, temp_dirs = utils.get_driver()
     url = info.url
     logging.info(f"Scrap with browser: {url}")
+    image = None
 
     try:
-        driver.get(url)
-        sleep(5)
-        utils.wait_for_requests_to_complete(driver)
-        popups = utils.handle_popup(driver)
-        logging.info(popups)
-
-        driver.execute_script(
+        # 从进程内的浏览器池中取出一个已启动的 Chrome, 用完后重置状态归还
+        with driver_pool.acquire() as driver:
+            if info.blocking_profile is not None:
+                driver.blocking_profile = info.blocking_profile
+            # 只捕获目标站点和 JSON 接口的请求, 其余请求直接透传
+            capture.set_scope(driver, url)
+            # 按 profile 记录页面加载耗时, 用于比较不同拦截策略的收益
+            with metrics.timer(f"blocking.{driver.blocking_profile}.page_load_seconds"):
+                driver.get(url)
+            # 等到网络空闲且 DOM 不再变化, 不再固定等待
+            readiness.wait_until_ready(driver, stages=("network", "dom"))
+            popups = utils.handle_popup(driver)
+            logging.info(popups)
+
+            driver.execute_script(
+                """
+                window.scroll({
+                    top: 99999,
+                    left: 0,
+                    behavior: 'smooth'
+                });
             """
-            window.scroll({
-                top: 99999,
-                left: 0,
-                behavior: 'smooth'
-            });
-        """
-        )
+            )
 
-        utils.wait_for_requests_to_complete(driver)
-        utils.wait_for_images_to_load(driver)
+            readiness.wait_until_ready(driver)
+
+            if capture.HARVEST_JSON:
+                # 页面渲染时加载的 JSON 接口里已经有列表数据, 直接使用
+                array, source, score = utils.find_most_related_array_in(
+                    capture.captured_json_responses(driver)
+                )
+                if (
+                    array is not None
+                    and len(array) >= capture.HARVEST_MIN_ITEMS
+                    and score >= capture.HARVEST_MIN_SCORE
+                ):
+                    metrics.incr("json_harvest.hit")
+                    logging.info(f"Found {len(array)} listings from {source['url']}")
+                    items = [json.dumps(item) for item in array]
+                    return items, None, driver.page_source, None, source
+                metrics.incr("json_harvest.miss")
+
+            if utils.DOM_FAST_PATH:
+                # 页面结构足够清晰时直接使用 DOM 结果, 不再截图和运行视觉模型
+                html_list, parent, confidence = utils.get_dom_listing(driver)
+                if confidence >= utils.DOM_FAST_PATH_MIN_CONFIDENCE:
+                    metrics.incr("dom_fast_path.hit")
+                    logging.info(f"Found {len(html_list)} listings from DOM layout")
+                    return html_list, parent, driver.page_source, None, None
+                metrics.incr("dom_fast_path.miss")
+
+            width = driver.execute_script(
+                "return Math.max(document.body.scrollWidth, document.body.offsetWidth, document.documentElement.clientWidth, document.documentElement.scrollWidth, document.documentElement.offsetWidth);"
+            )
+            height = driver.execute_script(
+                "return Math.max(document.body.scrollHeight, document.body.offsetHeight, document.documentElement.clientHeight, document.documentElement.scrollHeight, document.documentElement.offsetHeight);"
+            )
 
-        width = driver.execute_script(
-            "return Math.max(document.body.scrollWidth, document.body.offsetWidth, document.documentElement.clientWidth, document.documentElement.scrollWidth, document.documentElement.offsetWidth);"
-        )
-        height = driver.execute_script(
-            "return Math.max(document.body.scrollHeight, document.body.offsetHeight, document.documentElement.clientHeight, document.documentElement.scrollHeight, document.documentElement.offsetHeight);"
-        )
+            logging.info(f"Window size: {width}x{height}")
 
-        logging.info(f"Window size: {width}x{height}")
-        driver.set_window_size(width, height)
+            tiled = info.tiled
+            if tiled is None:
+                tiled = height > utils.TILED_DETECTION_MIN_HEIGHT
 
-        driver.execute_script(
-            """
-            window.scroll({
-                top: 0,
-                left: 0,
-                behavior: 'smooth'
-            });
-        """
-        )
+            if tiled:
+                # 按视口分段截图并批量检测, 内存占用与页面长度无关
+                watch_boxes = utils.watch_detect_tiled(driver, height)
+            else:
+                driver.set_window_size(width, height)
 
-        full_page = driver.find_element(By.TAG_NAME, "body")
-        screenshot = full_page.screenshot_as_png
+                driver.execute_script(
+                    """
+                    window.scroll({
+                        top: 0,
+                        left: 0,
+                        behavior: 'smooth'
+                    });
+                """
+                )
 
-        image = Image.open(io.BytesIO(screenshot))
-        watch_boxes = utils.watch_detect(image)
+                full_page = driver.find_element(By.TAG_NAME, "body")
+                screenshot = full_page.screenshot_as_png
 
-        logging.info(f"Detected {len(watch_boxes)} Watches-----------------")
+                image = Image.open(io.BytesIO(screenshot))
+                del screenshot
+                watch_boxes = utils.watch_detect(image)
 
-        if len(watch_boxes) == 0:
-            return [], None, driver.page_source, None
+            logging.info(f"Detected {len(watch_boxes)} Watches-----------------")
 
-        html_list, parent = utils.get_html_list(watch_boxes, driver)
+            if len(watch_boxes) == 0:
+                return [], None, driver.page_source, None, None
 
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        image_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            html_list, parent = utils.get_html_list(watch_boxes, driver)
 
-        return html_list or [], parent, driver.page_source, image_base64
+            # 分段检测时不保留整页截图
+            image_base64 = None
+            if image is not None:
+                buffered = io.BytesIO()
+                image.save(buffered, format="PNG")
+                image_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+            return html_list or [], parent, driver.page_source, image_base64, None
 
     except Exception as e:
         logging.info(e)
-        return [], None, None, None
+        # 浏览器异常不一定能在进程间序列化, 统一转换后交给调用方处理
+        raise RuntimeError(f"Browser scraping failed: {e}") from None
     finally:
-        utils.clean_up_driver(driver, temp_dirs)
-        driver.quit()
-        image.close()
+        if image is not None:
+            image.close()
         gc.collect()  # 手动触发垃圾回收
-        logging.info(f"Quit driver {driver.session_id}")
 
 
-@router.post("/scrap/list/browser")
-async def scrapListBrowser(info: ScrapListBrowserInfo):
-    # 在每个请求中创建单独的 ProcessPoolExecutor
-    with ProcessPoolExecutor(max_workers=1) as executor:
-        loop = asyncio.get_event_loop()
-        domain = urlparse(info.url).netloc
-
-        try:
-            html_list, parent, page_source, image_base64 = await loop.run_in_executor(
-                executor, run_selenium_scraping, info
-            )
+async def scrap_list_browser(info: ScrapListBrowserInfo):
+    # 任务队列和批量抓取共用, 出错时直接抛出异常
+    domain = urlparse(info.url).netloc
 
-            s3_uuid = await utils.upload_html_to_s3(page_source)
-
-            if len(html_list) == 0:
-                return {
-                    "message": "Can not find any watches",
-                    "listings": [],
-                    "s3_uuid": s3_uuid,
-                    "parent": None,
-                    "image_base64": image_base64,
-                }
-
-            if info.parent is not None and parent != info.parent:
-                return {"listings": [], "parent": parent, "s3_uuid": s3_uuid}
-
-            if html_list is not None:
-                logging.info(f"Found {len(html_list)} DOM elements-----------------")
-
-                tasks = [
-                    utils.extractWithOpenAI(
-                        f"Try extract the watch data from the following HTML: "
-                        + html
-                        + "\n\n"
-                        + f"""
-                            There are a few conditions you have to follow:
-
-                            1, the expected fields are name, image, description, brand, price, collection, reference, url(with domain:{domain})
-                            2, if one of the fields is missing, set it to null
-                            3, don't give me the code, just give me the json result, no need for more explanation
-                            4, The image and url must be a full address starting with http or https
-                            5, The price should be with currency symbol
-                        """,
-                        model="gpt-4",
-                    )
-                    for html in html_list
-                ]
-
-                results = await asyncio.gather(*tasks)
-
-                output = [
-                    json.loads(extracted) for extracted in results if extracted is not None
-                ]
-
-                return {"listings": output, "parent": parent, "s3_uuid": s3_uuid}
+    # 在常驻 worker 进程中执行, 模型和依赖已经预加载
+    html_list, parent, page_source, image_base64, api_source = (
+        await worker_pool.run(run_selenium_scraping, info)
+    )
 
-            else:
-                return {"listings": [], "parent": parent, "s3_uuid": s3_uuid}
-        
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return {"message": "Error during scraping"}
+    s3_uuid = await utils.upload_html_to_s3(page_source, url=info.url)
+
+    if len(html_list) == 0:
+        return {
+            "message": "Can not find any watches",
+            "listings": [],
+            "s3_uuid": s3_uuid,
+            "parent": None,
+            "image_base64": image_base64,
+        }
+
+    if api_source is not None:
+        # 返回找到的接口, 之后可以直接用 /scrap/list/json 抓取
+        conditions = extraction.build_conditions(domain, price_with_currency=True)
+        output = await extraction.extract_listings(
+            html_list, "JSON", conditions, domain=domain
+        )
+        return {
+            "listings": output,
+            "parent": None,
+            "s3_uuid": s3_uuid,
+            "api_source": api_source,
+        }
+
+    if info.parent is not None and parent != info.parent:
+        return {"listings": [], "parent": parent, "s3_uuid": s3_uuid}
+
+    if html_list is not None:
+        logging.info(f"Found {len(html_list)} DOM elements-----------------")
+
+        conditions = extraction.build_conditions(domain, price_with_currency=True)
+
+        # 多个列表项打包进同一个请求, 校验失败的再逐个提取
+        output = await extraction.extract_listings(
+            html_list, "HTML", conditions, domain=domain
+        )
 
+        return {"listings": output, "parent": parent, "s3_uuid": s3_uuid}
+
+    else:
+        return {"listings": [], "parent": parent, "s3_uuid": s3_uuid}
+
+
+@router.post("/scrap/list/browser")
+async def scrapListBrowser(info: ScrapListBrowserInfo):
+    try:
+        return await scrap_list_browser(info)
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return {"message": "Error during scraping"}
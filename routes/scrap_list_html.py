@@ -1,42 +1,35 @@
-import json
-import os
-import asyncio
 from typing import Optional
 from urllib.parse import urlparse
 from fastapi import APIRouter
-import httpx
-from common import utils
+from common import utils, worker_pool, extraction, fetcher, fetch_state, metrics
 from models.scrap_list_info import ScrapListInfo
 
 router = APIRouter(tags=["Scrap api"])
 
 
-@router.post("/scrap/list/html")
-async def scrapListHtml(info: ScrapListInfo):
+async def scrap_list_html(info: ScrapListInfo):
+    # 同步接口和批量抓取共用
     domain = urlparse(info.url).netloc
-    # 从环境变量获取代理
-    proxy = os.getenv("PROXY")
-    proxies = None
     print(f"Scrap with html: {info.url}")
 
-    if proxy:
-        print(f"Use proxy {proxy}")
-        proxies = {"http://": proxy, "https://": proxy}
-    else:
-        proxies = None
-
-    async with httpx.AsyncClient(proxies=proxies, verify=False, timeout=30) as client:
-        if info.payload is None:
-            response = await client.get(info.url)
-        else:
-            if info.payload_type == "form":
-                # 将 payload 转换为符合 multipart/form-data 的格式，确保所有字段都是字符串
-                form_data = {key: str(value) for key, value in info.payload.items()}
-                response = await client.post(
-                    info.url, data=form_data
-                )  # 使用data代替files
-            elif info.payload_type == "json":
-                response = await client.post(info.url, json=info.payload)
+    # 带上次的 ETag/Last-Modified 发送条件请求, 内容没变时直接返回上次的结果
+    state_key = fetch_state.make_key("HTML", info)
+    state = fetch_state.load(state_key)
+
+    # 共用长连接客户端, 同一站点的请求复用连接
+    response = await fetcher.fetch_info(
+        info, headers=fetch_state.conditional_headers(state)
+    )
+
+    body_hash = fetch_state.hash_body(response.content)
+    if fetch_state.is_unchanged(state, response, body_hash):
+        metrics.incr("fetch_state.unchanged")
+        return {
+            "listings": fetch_state.previous_result(state),
+            "parent": state["parent"],
+            "s3_uuid": state["s3_uuid"],
+            "unchanged": True,
+        }
 
     html_str = response.content
     if info.response_key is not None:
@@ -52,40 +45,35 @@ async def scrapListHtml(info: ScrapListInfo):
         response_json = response.json()
         html_str = get_nested_value(response_json, info.response_key)
 
-    s3_uuid = await utils.upload_html_to_s3(html_str)
-
-    html_list, parent = utils.get_api_html_list(html_str) or ([], "")
-
-    conditions = f"""
-        There are a few conditions you have to follow:
+    s3_uuid = await utils.upload_html_to_s3(html_str, url=info.url)
 
-        1, the expected fields are name, image, description, brand, price, collection, reference, url(with domain:{domain})
-        2, if one of the fields is missing, set it to null
-        3, don't give me the code, just give me the json result, no need for more explanation
-        4, The image and url must be a full address starting with http or https
-        """
-    if info.detail_url_template:
-        conditions += (
-            f"\n5, And here is a detail url template: {info.detail_url_template}"
-        )
+    # 大响应的 DOM 解析在常驻 worker 进程中执行, 不阻塞事件循环也不占用主进程的 GIL
+    result = await worker_pool.run(utils.get_api_html_list, html_str)
+    html_list, parent = result or ([], "")
 
-    tasks = [
-        utils.extractWithOpenAI(
-            f"Try extract the watch data from the following HTML: "
-            + html
-            + "\n\n"
-            + conditions,
-            model="gpt-4",
-        )
-        for html in html_list
-    ]
+    conditions = extraction.build_conditions(
+        domain, detail_url_template=info.detail_url_template
+    )
 
-    # 并发执行所有任务
-    results = await asyncio.gather(*tasks)
+    # 只有新增或变化的列表项才需要提取
+    item_hashes, changed = fetch_state.split_items(state, html_list)
 
-    # 过滤 None 结果并解析 JSON
-    output = [json.loads(extracted) for extracted in results if extracted is not None]
+    # 多个列表项打包进同一个请求, 校验失败的再逐个提取
+    extracted = await extraction.extract_listing_map(
+        [html_list[index] for index in changed], "HTML", conditions, domain=domain
+    )
+    listings, output = fetch_state.merge_listings(
+        state, item_hashes, changed, extracted
+    )
+    fetch_state.save(
+        state_key, info.url, response, body_hash, item_hashes, listings, parent, s3_uuid
+    )
 
     print(f"Found {len(output)} Listing-----------------")
 
     return {"listings": output, "parent": parent, "s3_uuid": s3_uuid}
+
+
+@router.post("/scrap/list/html")
+async def scrapListHtml(info: ScrapListInfo):
+    return await scrap_list_html(info)
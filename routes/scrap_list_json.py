@@ -1,85 +1,73 @@
 import json
-import os
-import asyncio
 from urllib.parse import urlparse
 from fastapi import APIRouter
-import httpx
-from concurrent.futures import ProcessPoolExecutor
-from common import utils
+from common import utils, worker_pool, extraction, fetcher, fetch_state, metrics
 from models.scrap_list_info import ScrapListInfo
 
 router = APIRouter(tags=["Scrap api"])
 
 
-def find_most_related_array_in_process(res):
-    list, score = utils.find_most_related_array(res)
-    return list, score
-
-
-@router.post("/scrap/list/json")
-async def scrapListJson(info: ScrapListInfo):
+async def scrap_list_json(info: ScrapListInfo):
+    # 同步接口和批量抓取共用
     url = info.url
     domain = urlparse(url).netloc
     print(f"Scrap with json: {url}")
 
-    # 从环境变量获取代理
-    proxy = os.getenv("PROXY")
-    proxies = None
-
-    if proxy:
-        print(f"Use proxy {proxy}")
-        proxies = {"http://": proxy, "https://": proxy}
-    else:
-        proxies = None
-
-    async with httpx.AsyncClient(proxies=proxies, verify=False, timeout=30) as client:
-        if info.payload is None:
-            response = await client.get(info.url)
-        else:
-            if info.payload_type == "form":
-                # 将 payload 转换为符合 multipart/form-data 的格式
-                form_data = {key: str(value) for key, value in info.payload.items()}
-                response = await client.post(info.url, data=form_data)
-            elif info.payload_type == "json":
-                response = await client.post(info.url, json=info.payload)
+    # 带上次的 ETag/Last-Modified 发送条件请求, 内容没变时直接返回上次的结果
+    state_key = fetch_state.make_key("JSON", info)
+    state = fetch_state.load(state_key)
+
+    # 共用长连接客户端, 同一站点的请求复用连接
+    response = await fetcher.fetch_info(
+        info, headers=fetch_state.conditional_headers(state)
+    )
+
+    body_hash = fetch_state.hash_body(response.content)
+    if fetch_state.is_unchanged(state, response, body_hash):
+        metrics.incr("fetch_state.unchanged")
+        return {
+            "listings": fetch_state.previous_result(state),
+            "parent": None,
+            "s3_uuid": state["s3_uuid"],
+            "unchanged": True,
+        }
 
     res = response.json()
-    s3_uuid = await utils.upload_html_to_s3(json.dumps(res))
+    # 原样归档接口返回的内容, 不再重新序列化
+    s3_uuid = await utils.upload_html_to_s3(
+        response.content, "application/json", url
+    )
 
-    # 使用ProcessPoolExecutor来处理find_most_related_array操作
-    with ProcessPoolExecutor(max_workers=1) as executor:
-        loop = asyncio.get_event_loop()
-        list, _ = await loop.run_in_executor(
-            executor, find_most_related_array_in_process, res
-        )
+    # 在常驻 worker 进程中执行find_most_related_array, 分类模型已经预加载
+    list, _ = await worker_pool.run(utils.find_most_related_array, res)
 
     if list is None:
         return {"listings": [], "parent": None}
 
     print(f"Detected {len(list)} Watches-----------------")
 
-    tasks = [
-        utils.extractWithOpenAI(
-            f"Try extract the watch data from the following JSON: "
-            + json.dumps(item)
-            + "\n\n"
-            + f"""
-                        There are a few conditions you have to follow:
-                        1, the expected fields are name, image, description, brand, price, collection, reference, url(with domain:{domain})
-                        2, if one of the fields is missing, set it to null
-                        3, don't give me the code, just give me the json result, no need for more explanation
-                        4, The image and url must be a full address starting with http or https
-                    """,
-            model="gpt-4",
-        )
-        for item in list
-    ]
-    # 并发执行所有任务
-    results = await asyncio.gather(*tasks)
-
-    # 过滤 None 结果并解析 JSON
-    output = [json.loads(extracted) for extracted in results if extracted is not None]
+    conditions = extraction.build_conditions(domain)
+
+    # 只有新增或变化的列表项才需要提取
+    items = [json.dumps(item) for item in list]
+    item_hashes, changed = fetch_state.split_items(state, items)
+
+    # 多个列表项打包进同一个请求, 校验失败的再逐个提取
+    extracted = await extraction.extract_listing_map(
+        [items[index] for index in changed], "JSON", conditions, domain=domain
+    )
+    listings, output = fetch_state.merge_listings(
+        state, item_hashes, changed, extracted
+    )
+    fetch_state.save(
+        state_key, info.url, response, body_hash, item_hashes, listings, None, s3_uuid
+    )
 
     print(f"Found {len(output)} Listing-----------------")
 
     return {"listings": output, "parent": None, "s3_uuid": s3_uuid}
+
+
+@router.post("/scrap/list/json")
+async def scrapListJson(info: ScrapListInfo):
+    return await scrap_list_json(info)